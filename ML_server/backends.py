@@ -0,0 +1,133 @@
+import inspect
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification
+
+# How the sentiment model runs: PyTorch full precision, PyTorch with int8 dynamic quantization of
+# the Linear layers, or an exported ONNX graph run with ONNX Runtime (optionally with int8 weights)
+BACKENDS = ('fp32', 'int8', 'onnx', 'onnx-int8')
+# Exported and quantized models are cached here, one directory per model
+ARTIFACT_DIR = os.environ.get('SENTIMENT_ARTIFACT_DIR', './models')
+
+ARTIFACT_FILES = {'int8': 'int8.pt', 'onnx': 'model.onnx', 'onnx-int8': 'model-int8.onnx'}
+ONNX_OPSET = 17
+
+
+def artifact_path(model_name, backend, artifact_dir=ARTIFACT_DIR):
+    return os.path.join(artifact_dir, model_name.strip('/').replace('/', '--'), ARTIFACT_FILES[backend])
+
+
+def artifact_meta(model_name, backend, artifact_dir=ARTIFACT_DIR):
+    """The .json entry written next to an artifact, or None when it has not been exported."""
+    try:
+        with open(artifact_path(model_name, backend, artifact_dir) + '.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def update_meta(model_name, backend, fields, artifact_dir=ARTIFACT_DIR):
+    path = artifact_path(model_name, backend, artifact_dir) + '.json'
+    meta = artifact_meta(model_name, backend, artifact_dir) or {}
+    meta.update(fields)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return meta
+
+
+class _Logits(torch.nn.Module):
+    """The classifier with plain tensor inputs and the logits as its only output, for the ONNX exporter."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def export(model_name, backend, artifact_dir=ARTIFACT_DIR):
+    """Build the artifact of backend from the fp32 model and cache it. Returns its path."""
+    path = artifact_path(model_name, backend, artifact_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    start = time.perf_counter()
+
+    if backend == 'onnx-int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        source = artifact_path(model_name, 'onnx', artifact_dir)
+        if not os.path.isfile(source):
+            export(model_name, 'onnx', artifact_dir)
+        quantize_dynamic(source, path + '.tmp', weight_type=QuantType.QInt8)
+    else:
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        if backend == 'int8':
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            torch.save(model, path + '.tmp')
+        elif backend == 'onnx':
+            dummy = torch.ones((2, 8), dtype=torch.long)
+            # Newer torch releases export with dynamo by default; older ones (like 2.4) have no such option
+            options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+            torch.onnx.export(_Logits(model), (dummy, torch.ones_like(dummy)), path + '.tmp',
+                              input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                              dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                            'attention_mask': {0: 'batch', 1: 'sequence'},
+                                            'logits': {0: 'batch'}},
+                              opset_version=ONNX_OPSET, **options)
+        else:
+            raise ValueError(f"Nothing to export for backend {backend}")
+    os.replace(path + '.tmp', path)
+
+    update_meta(model_name, backend, {
+        'model': model_name,
+        'backend': backend,
+        'torch': torch.__version__,
+        'size_mb': round(os.path.getsize(path) / 2 ** 20, 1),
+        'export_s': round(time.perf_counter() - start, 1),
+        'exported_at': datetime.now().isoformat(timespec='seconds'),
+        'parity': None,  # Set by benchmarks/compare_backends.py
+    }, artifact_dir)
+    return path
+
+
+def load(model_name, backend, device, artifact_dir=ARTIFACT_DIR):
+    """A function from (input_ids, attention_mask) tensors to the logits as a NumPy array."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown sentiment backend: {backend} (one of {', '.join(BACKENDS)})")
+    if backend == 'fp32':
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).to(device).eval()
+        return _torch_runner(model, device)
+
+    path = artifact_path(model_name, backend, artifact_dir)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No {backend} artifact at {path}, "
+                                f"run: python export_model.py --model {model_name} --backend {backend}")
+    if device.type != 'cpu':
+        raise ValueError(f"The {backend} backend runs on the CPU only")
+    if backend == 'int8':
+        return _torch_runner(torch.load(path, weights_only=False).eval(), device)
+
+    import onnxruntime
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+    def run(input_ids, attention_mask):
+        return session.run(['logits'], {'input_ids': input_ids.numpy(), 'attention_mask': attention_mask.numpy()})[0]
+    return run
+
+
+def _torch_runner(model, device):
+    def run(input_ids, attention_mask):
+        with torch.no_grad():
+            logits = model(input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+        return logits.float().cpu().numpy()
+    return run
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
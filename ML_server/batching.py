@@ -0,0 +1,152 @@
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+# Upper bounds (in tokens) of the length buckets; a batch only mixes reviews of one bucket
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+class MicroBatcher:
+    """
+    Batches reviews across requests for a SentimentModel. Reviews are
+    tokenized when they are queued and sorted into length buckets; each
+    bucket holds a queue per request. One scheduler thread forms the
+    batches: from the bucket whose oldest review has waited longest, it takes
+    a review from each request in turn until it has max_batch_size of them,
+    or runs what it has once that review has waited max_wait_ms. A batch is
+    padded only to its longest review, so a few long reviews no longer pad
+    every short one to their length. Every review gets a future with its
+    label and probabilities, so each request follows its own progress and
+    gets its results back in its own order, and a large request cannot hold
+    back a small one that arrives after it.
+
+    With length_buckets=None all reviews share one bucket.
+    """
+
+    def __init__(self, sentiment_model, max_batch_size=16, max_wait_ms=20, length_buckets=LENGTH_BUCKETS):
+        self.model = sentiment_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.length_buckets = length_buckets
+        # Bucket -> one deque of (token ids, future, queued_at) per request, in turn order
+        self._buckets = {}
+        self._cond = threading.Condition()
+        self.counters = {'requests': 0, 'batches': 0, 'reviews': 0, 'cancelled': 0, 'failed_batches': 0,
+                         'tokens': 0, 'padded_tokens': 0}
+        self.batch_sizes = deque(maxlen=1000)
+        self.waits = deque(maxlen=1000)
+
+    def start(self):
+        threading.Thread(target=self._loop, name='sentiment-batcher', daemon=True).start()
+        return self
+
+    def _bucket(self, length):
+        if self.length_buckets is None:
+            return 0
+        return next((bound for bound in self.length_buckets if length <= bound), self.length_buckets[-1])
+
+    def submit(self, reviews):
+        """Queue the reviews of one request. Returns a future per review, in order."""
+        encoded = self.model.encode(reviews) if len(reviews) else []
+        now = time.monotonic()
+        futures = [Future() for _ in encoded]
+        pending = {}
+        for ids, future in zip(encoded, futures):
+            pending.setdefault(self._bucket(len(ids)), deque()).append((ids, future, now))
+        with self._cond:
+            self.counters['requests'] += 1
+            for bucket, reviews in pending.items():
+                self._buckets.setdefault(bucket, deque()).append(reviews)
+            if pending:
+                self._cond.notify()
+        return futures
+
+    def _take(self):
+        """Wait for the next batch, taking one review from each request in turn."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due, next_deadline = None, None
+                for bucket, requests in self._buckets.items():
+                    oldest = min(pending[0][2] for pending in requests)
+                    queued = sum(len(pending) for pending in requests)
+                    if queued >= self.max_batch_size or now >= oldest + self.max_wait:
+                        if due is None or oldest < due[0]:
+                            due = (oldest, bucket)
+                    elif next_deadline is None or oldest + self.max_wait < next_deadline:
+                        next_deadline = oldest + self.max_wait
+                if due is not None:
+                    break
+                self._cond.wait(None if next_deadline is None else next_deadline - now)
+
+            bucket = due[1]
+            requests = self._buckets[bucket]
+            batch = []
+            while requests and len(batch) < self.max_batch_size:
+                pending = requests.popleft()
+                ids, future, queued_at = pending.popleft()
+                if pending:
+                    requests.append(pending)
+                # False when the request was cancelled while the review waited
+                if future.set_running_or_notify_cancel():
+                    batch.append((ids, future, queued_at))
+                else:
+                    self.counters['cancelled'] += 1
+            if not requests:
+                del self._buckets[bucket]
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                continue
+            start = time.monotonic()
+            encoded = [ids for ids, _, _ in batch]
+            try:
+                labels, probs = self.model.predict(self.model.pad(encoded))
+            except Exception as e:
+                traceback.print_exc()
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._cond:
+                    self.counters['failed_batches'] += 1
+                continue
+
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result((int(labels[i]), probs[i]))
+            with self._cond:
+                self.counters['batches'] += 1
+                self.counters['reviews'] += len(batch)
+                self.counters['tokens'] += sum(len(ids) for ids in encoded)
+                self.counters['padded_tokens'] += len(encoded) * max(len(ids) for ids in encoded)
+                self.batch_sizes.append(len(batch))
+                self.waits.extend(start - queued_at for _, _, queued_at in batch)
+
+    def stats(self):
+        with self._cond:
+            counters = dict(self.counters)
+            queued = sum(len(pending) for requests in self._buckets.values() for pending in requests)
+            sizes = np.array(self.batch_sizes)
+            waits = np.array(self.waits) * 1000
+
+        def percentile(values, q):
+            return round(float(np.percentile(values, q)), 1) if len(values) else None
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'length_buckets': self.length_buckets,
+            'queued': queued,
+            **counters,
+            # Share of the tokens run through the model that were padding
+            'padding_share': round(1 - counters['tokens'] / counters['padded_tokens'], 3)
+            if counters['padded_tokens'] else None,
+            'batch_size_mean': round(float(sizes.mean()), 1) if len(sizes) else None,
+            'wait_ms_p50': percentile(waits, 50),
+            'wait_ms_p95': percentile(waits, 95),
+        }
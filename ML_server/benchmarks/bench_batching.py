@@ -0,0 +1,125 @@
+"""
+Sentiment inference under concurrent requests. `--requests` requests of
+`--reviews` reviews each arrive together (within `--spread` seconds) and share
+one resident model. Reports the reviews per second over the whole run, the
+request latency from arrival to the last label, the batch sizes formed and
+the share of the tokens run through the model that were padding:
+
+  per-request 2     the previous path: every request runs its own batches of 2,
+                    all padded to the request's longest review
+  flat B/W ms       one MicroBatcher for all requests, batches of up to B
+                    reviews, run once the oldest review has waited W ms
+  buckets B/W ms    the same, with a batch only mixing reviews of similar length
+
+Reviews come from `--csv` (a `review_body` column, e.g. the file
+download_and_extract_data writes), or are generated. Run from the ML_server
+directory:
+
+    python benchmarks/bench_batching.py --requests 8 --reviews 32 --settings 8:10 16:20 32:50
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import LENGTH_BUCKETS, MicroBatcher  # noqa: E402
+from sentiment_analyzer import batch_inference_sentiment_roberta, preprocess_text  # noqa: E402
+from sentiment_model import MODEL_NAME, SentimentModel  # noqa: E402
+
+WORDS = ("the battery lasts all day and the screen is bright but the case feels cheap and "
+         "shipping took two weeks which was annoying overall i would buy it again").split()
+
+
+def load_reviews(csv_path, count, seed=0):
+    if csv_path:
+        reviews = pd.read_csv(csv_path)['review_body'].dropna().astype(str).tolist()
+        return random.Random(seed).sample(reviews, min(count, len(reviews)))
+    rng = random.Random(seed)
+    # Mostly short reviews with a few long ones, as on a product page
+    return [' '.join(rng.choices(WORDS, k=int(rng.paretovariate(1.5) * 12))) for _ in range(count)]
+
+
+def per_request(reviews, model, padding, batch_size=2):
+    """The path before batching: tokenize the request's reviews together, run them in batches of batch_size."""
+    inputs = model.tokenize([preprocess_text(review) for review in reviews])
+    padding.append((int(inputs['attention_mask'].sum()), inputs['attention_mask'].numel()))
+    for i in range(0, len(reviews), batch_size):
+        model.predict({k: v[i:i + batch_size] for k, v in inputs.items()})
+
+
+def batched(reviews, batcher):
+    for _ in batch_inference_sentiment_roberta(reviews, batcher):
+        pass
+
+
+def run(requests, run_request, spread):
+    """Run the requests in concurrent threads. Returns the wall time and each request's latency."""
+    latencies = [None] * len(requests)
+
+    def client(i):
+        time.sleep(random.uniform(0, spread))
+        start = time.perf_counter()
+        run_request(requests[i])
+        latencies[i] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(len(requests))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_NAME, help='model name or local directory')
+    parser.add_argument('--csv', help='reviews to use, with a review_body column')
+    parser.add_argument('--requests', type=int, default=8, help='concurrent requests')
+    parser.add_argument('--reviews', type=int, default=32, help='reviews per request')
+    parser.add_argument('--spread', type=float, default=0.5, help='seconds over which the requests arrive')
+    parser.add_argument('--settings', nargs='+', default=['8:10', '16:20', '32:50'],
+                        help='max batch size:max wait ms of each batched run')
+    args = parser.parse_args()
+
+    model = SentimentModel(args.model).load()
+    if not model.ready.is_set():
+        sys.exit(f"Could not load {args.model}: {model.error}")
+    reviews = load_reviews(args.csv, args.requests * args.reviews)
+    requests = [reviews[i::args.requests] for i in range(args.requests)]
+    print(f"{args.requests} requests of {len(requests[0])} reviews on {model.device}, "
+          f"{torch.get_num_threads()} intra-op threads")
+
+    results = []
+    padding = []
+    elapsed, latencies = run(requests, lambda request: per_request(request, model, padding), args.spread)
+    tokens, padded = np.sum(padding, axis=0)
+    results.append(('per-request 2', elapsed, latencies, 2.0, 1 - tokens / padded))
+
+    for setting in args.settings:
+        max_batch, max_wait = setting.split(':')
+        for name, buckets in (('flat', None), ('buckets', LENGTH_BUCKETS)):
+            batcher = MicroBatcher(model, int(max_batch), float(max_wait), buckets).start()
+            elapsed, latencies = run(requests, lambda request: batched(request, batcher), args.spread)
+            stats = batcher.stats()
+            results.append((f'{name} {max_batch}/{max_wait} ms', elapsed, latencies, stats['batch_size_mean'],
+                            stats['padding_share']))
+
+    total = sum(len(request) for request in requests)
+    print(f"\n{'path':<20}{'reviews/s':>10}{'speedup':>9}{'latency p50':>13}{'p95':>8}{'batch':>7}{'padding':>9}")
+    for name, elapsed, latencies, batch_size, padding_share in results:
+        print(f"{name:<20}{total / elapsed:>10.1f}{results[0][1] / elapsed:>8.1f}x"
+              f"{np.percentile(latencies, 50):>12.2f}s{np.percentile(latencies, 95):>7.2f}s{batch_size:>7.1f}"
+              f"{padding_share:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
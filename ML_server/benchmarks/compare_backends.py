@@ -0,0 +1,106 @@
+"""
+Accuracy and speed of the sentiment backends against fp32 on a labeled review
+set (loaded with download_and_extract_data: `--csv`, downloaded from `--url`
+if missing). Labels come from `--label-column`: 0/1 values are used as they
+are, star ratings count as positive from 4 and negative up to 2 (3 is dropped).
+
+For every backend the report lists the accuracy, the share of labels that
+agree with fp32, the largest probability difference and the reviews per
+second. A backend passes when its accuracy is at most `--max-drop` below
+fp32's; the result is recorded in the artifact's .json entry, which the ML
+server reports under /ready. Exits with status 1 if a backend fails. Export
+the artifacts first (export_model.py), then run from the ML_server directory:
+
+    python benchmarks/compare_backends.py --csv reviews.csv --samples 1000 --backend int8 onnx onnx-int8
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends  # noqa: E402
+from sentiment_analyzer import download_and_extract_data, preprocess_text  # noqa: E402
+from sentiment_model import MODEL_NAME, SentimentModel  # noqa: E402
+
+
+def load_labeled(url, csv_path, label_column, samples):
+    data = download_and_extract_data(url, csv_path)
+    labels = data[label_column]
+    if not set(labels.dropna().unique()) <= {0, 1}:
+        # Star ratings: drop the neutral ones
+        data = data[(labels >= 4) | (labels <= 2)]
+        labels = (data[label_column] >= 4).astype(int)
+    return data['review_body'].astype(str).tolist()[:samples], labels.astype(int).to_numpy()[:samples]
+
+
+def predict(model, reviews, batch_size):
+    """Labels and probabilities of the reviews, in batches of similar length. Returns them with the seconds taken."""
+    start = time.perf_counter()
+    encoded = model.encode([preprocess_text(review) for review in reviews])
+    order = np.argsort([len(ids) for ids in encoded], kind='stable')
+    labels, probs = np.empty(len(reviews), dtype=int), np.empty((len(reviews), 2))
+    for i in range(0, len(order), batch_size):
+        batch = order[i:i + batch_size]
+        labels[batch], probs[batch] = model.predict(model.pad([encoded[j] for j in batch]))
+    return labels, probs, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_NAME, help='model name or local directory')
+    parser.add_argument('--csv', required=True, help='labeled reviews, with review_body and the label column')
+    parser.add_argument('--url', help='zip to download the reviews from if --csv does not exist')
+    parser.add_argument('--label-column', default='star_rating')
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--backend', nargs='+', default=['int8', 'onnx', 'onnx-int8'],
+                        choices=[backend for backend in backends.BACKENDS if backend != 'fp32'])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-drop', type=float, default=0.005, help='largest accuracy loss to accept, e.g. 0.005')
+    parser.add_argument('--artifact-dir', default=backends.ARTIFACT_DIR)
+    args = parser.parse_args()
+
+    reviews, truth = load_labeled(args.url, args.csv, args.label_column, args.samples)
+    print(f"{len(reviews)} labeled reviews, {truth.mean():.0%} positive")
+
+    results = {}
+    for backend in ['fp32'] + args.backend:
+        model = SentimentModel(args.model, backend=backend, artifact_dir=args.artifact_dir).load()
+        if not model.ready.is_set():
+            print(f"{backend}: skipped, {model.error}")
+            continue
+        results[backend] = predict(model, reviews, args.batch_size)
+    if 'fp32' not in results:
+        sys.exit("The fp32 model did not load, nothing to compare against")
+
+    base_labels, base_probs, base_s = results['fp32']
+    base_accuracy = float((base_labels == truth).mean())
+    failed = False
+    print(f"\n{'backend':<11}{'accuracy':>9}{'vs fp32':>9}{'agree':>8}{'max dp':>8}{'reviews/s':>11}{'speedup':>9}  parity")
+    for backend, (labels, probs, seconds) in results.items():
+        accuracy = float((labels == truth).mean())
+        parity = {
+            'accuracy': round(accuracy, 4),
+            'fp32_accuracy': round(base_accuracy, 4),
+            'agreement': round(float((labels == base_labels).mean()), 4),
+            'max_prob_diff': round(float(np.abs(probs - base_probs).max()), 4),
+            'speedup': round(base_s / seconds, 2),
+            'reviews': len(reviews),
+            'passed': accuracy >= base_accuracy - args.max_drop,
+            'checked_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        if backend != 'fp32':
+            backends.update_meta(args.model, backend, {'parity': parity}, args.artifact_dir)
+            failed = failed or not parity['passed']
+        print(f"{backend:<11}{accuracy:>9.2%}{accuracy - base_accuracy:>+9.2%}{parity['agreement']:>8.1%}"
+              f"{parity['max_prob_diff']:>8.3f}{len(reviews) / seconds:>11.1f}{parity['speedup']:>8.1f}x  "
+              f"{'-' if backend == 'fp32' else 'pass' if parity['passed'] else 'FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
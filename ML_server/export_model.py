@@ -0,0 +1,44 @@
+"""
+Export or quantize the sentiment model once for the CPU backends, and cache the
+result in the artifact directory (`SENTIMENT_ARTIFACT_DIR`, default ./models):
+
+  int8        PyTorch with the Linear layers quantized to int8 (dynamic quantization)
+  onnx        the model exported to an ONNX graph, run with ONNX Runtime
+  onnx-int8   the ONNX graph with int8 weights (ONNX Runtime dynamic quantization)
+
+Existing artifacts are kept unless `--force` is given. Check the accuracy of a
+backend against fp32 before switching the server to it with
+`SENTIMENT_BACKEND` (see benchmarks/compare_backends.py). Run from the
+ML_server directory:
+
+    python export_model.py --backend int8 onnx onnx-int8
+"""
+import argparse
+import os
+
+import backends
+from sentiment_model import MODEL_NAME
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_NAME, help='model name or local directory')
+    parser.add_argument('--backend', nargs='+', default=['onnx-int8'],
+                        choices=[backend for backend in backends.BACKENDS if backend != 'fp32'])
+    parser.add_argument('--artifact-dir', default=backends.ARTIFACT_DIR)
+    parser.add_argument('--force', action='store_true', help='export again even if the artifact exists')
+    args = parser.parse_args()
+
+    for backend in args.backend:
+        path = backends.artifact_path(args.model, backend, args.artifact_dir)
+        if os.path.isfile(path) and not args.force:
+            print(f"{backend}: {path} already exists")
+            continue
+        print(f"{backend}: exporting {args.model}...")
+        backends.export(args.model, backend, args.artifact_dir)
+        meta = backends.artifact_meta(args.model, backend, args.artifact_dir)
+        print(f"{backend}: wrote {path} ({meta['size_mb']} MB in {meta['export_s']} s)")
+
+
+if __name__ == '__main__':
+    main()
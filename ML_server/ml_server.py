@@ -10,10 +10,29 @@ from scrapy import signals
 from scrapy.signalmanager import dispatcher
 from scraper.scraper.spiders.AmazonScraping import AmazonSpider
 from sentiment_analyzer import analyze_sentiment, get_pros_cons, get_summary
+from sentiment_model import SentimentModel
+from batching import MicroBatcher
+from result_cache import SentimentCache
 from multiprocessing import Process, Queue as MPQueue
 
 app = Flask(__name__)
 
+# Loaded once in the background at startup and shared by every request; /ready answers 503 until it is warm.
+# SENTIMENT_BACKEND picks fp32 (default), int8, onnx or onnx-int8 (export those first with export_model.py)
+SENTIMENT_BACKEND = os.environ.get('SENTIMENT_BACKEND', 'fp32')
+sentiment_model = SentimentModel(backend=SENTIMENT_BACKEND)
+
+# Reviews of concurrent requests share batches: a batch runs once it has SENTIMENT_MAX_BATCH reviews,
+# or once its oldest review has waited SENTIMENT_MAX_WAIT_MS
+SENTIMENT_MAX_BATCH = int(os.environ.get('SENTIMENT_MAX_BATCH', 16))
+SENTIMENT_MAX_WAIT_MS = float(os.environ.get('SENTIMENT_MAX_WAIT_MS', 20))
+batcher = MicroBatcher(sentiment_model, SENTIMENT_MAX_BATCH, SENTIMENT_MAX_WAIT_MS)
+
+# Labels of reviews seen before, per model: SENTIMENT_CACHE_SIZE in memory in front of a SQLite file
+SENTIMENT_CACHE_PATH = os.environ.get('SENTIMENT_CACHE_PATH', './cache/sentiment.sqlite')
+SENTIMENT_CACHE_SIZE = int(os.environ.get('SENTIMENT_CACHE_SIZE', 100_000))
+sentiment_cache = SentimentCache(SENTIMENT_CACHE_PATH, SENTIMENT_CACHE_SIZE)
+
 def run_spider(urls, results_queue):
     results = []
 
@@ -87,7 +106,7 @@ def process_request(request):
 
     # Analyze the sentiment and get progress updates
     sentiment_result = None
-    for progress_update in analyze_sentiment(data):
+    for progress_update in analyze_sentiment(data, batcher, sentiment_cache):
         progress_data = json.loads(progress_update)
 
         if 'result' in progress_data:
@@ -128,6 +147,9 @@ def analyze():
     url = data.get('url')
     if not url:
         return jsonify({"error": "No URL provided"}), 400
+    if not sentiment_model.ready.is_set():
+        return jsonify({"error": "The sentiment model is not loaded yet" if sentiment_model.error is None else "The sentiment model failed to load",
+                        **sentiment_model.stats()}), 503
 
     def generate():
         for progress_update in process_request(url):
@@ -136,6 +158,16 @@ def analyze():
     # This response will stream progress updates back to the client
     return Response(generate(), mimetype='application/json')
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # 503 until the sentiment model is loaded and warmed up
+    status = sentiment_model.stats()
+    return jsonify(status), 200 if sentiment_model.ready.is_set() else 503
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'model': sentiment_model.stats(), 'batching': batcher.stats(), 'cache': sentiment_cache.stats()})
+
 @app.route('/create_ad', methods=['POST'])
 def create_ad():
     data = request.json
@@ -152,4 +184,7 @@ def create_ad():
     return jsonify({'ad_text': ad_text})
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    sentiment_model.start()
+    batcher.start()
+    # The reloader would run this block twice and load a second copy of the model
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
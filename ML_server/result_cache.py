@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# SQLite limits the number of parameters of a statement
+_QUERY_CHUNK = 500
+
+
+def review_key(model_id, text):
+    """Cache key of a preprocessed review for the model that labels it."""
+    return hashlib.sha256(f'{model_id}\0{text}'.encode()).hexdigest()
+
+
+class SentimentCache:
+    """
+    Labels and probabilities of preprocessed reviews, keyed by a hash of the
+    text and the model id, so an unchanged review is run through a given model
+    once. The `max_entries` most recently used results are kept in memory in
+    front of a SQLite table on local disk, which outlives restarts.
+    """
+
+    def __init__(self, path, max_entries=100_000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection shared by the request threads, used under the lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sentiment '
+                         '(key TEXT PRIMARY KEY, model TEXT, label INTEGER, probs TEXT, stored_at REAL)')
+        self._memory = OrderedDict()  # key -> (label, probs), least recently used first
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stored': 0}
+
+    def get_many(self, keys):
+        """The cached (label, probs) of those keys that have one, as a dict."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = value
+            memory_hits = len(found)
+
+            missing = list({key for key in keys if key not in found})
+            for i in range(0, len(missing), _QUERY_CHUNK):
+                chunk = missing[i:i + _QUERY_CHUNK]
+                rows = self._db.execute(f'SELECT key, label, probs FROM sentiment WHERE key IN '
+                                        f'({",".join("?" * len(chunk))})', chunk)
+                for key, label, probs in rows:
+                    found[key] = (label, json.loads(probs))
+                    self._remember(key, found[key])
+
+            self.counters['hits'] += memory_hits
+            self.counters['disk_hits'] += len(found) - memory_hits
+            self.counters['misses'] += len(missing) - (len(found) - memory_hits)
+        return found
+
+    def put_many(self, results, model_id):
+        """Store {key: (label, probs)} labeled by model_id."""
+        if not results:
+            return
+        rows = [(key, model_id, int(label), json.dumps([float(p) for p in probs]), time.time())
+                for key, (label, probs) in results.items()]
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO sentiment VALUES (?, ?, ?, ?, ?)', rows)
+            for key, (label, probs) in results.items():
+                self._remember(key, (int(label), [float(p) for p in probs]))
+            self.counters['stored'] += len(rows)
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            stored = self._db.execute('SELECT COUNT(*) FROM sentiment').fetchone()[0]
+            in_memory = len(self._memory)
+        lookups = counters['hits'] + counters['disk_hits'] + counters['misses']
+        return {
+            'path': self.path,
+            'entries': stored,
+            'in_memory': in_memory,
+            **counters,
+            'hit_rate': round((counters['hits'] + counters['disk_hits']) / lookups, 3) if lookups else None,
+        }
@@ -1,13 +1,11 @@
 import json
+from concurrent.futures import as_completed
 
 import google.generativeai as genai
 
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from tqdm import tqdm
-from torch.utils.data import DataLoader
 
 import torch
-import torch.nn.functional as F
 import re
 import pandas as pd
 import numpy as np
@@ -16,6 +14,8 @@ import zipfile
 import os
 import gc
 
+from result_cache import review_key
+
 def download_and_extract_data(url, csv_path):
     # Check if the file already exists
     if os.path.isfile(csv_path):
@@ -66,47 +66,49 @@ def preprocess_text(text):
     text = text.strip()  # Remove leading/trailing whitespace
     return text
 
-def batch_inference_sentiment_roberta(reviews, model, tokenizer, batch_size=32):
+def batch_inference_sentiment_roberta(reviews, batcher, cache=None):
     # Preprocess and convert to list
     reviews = [preprocess_text(review) for review in reviews]
 
-    # Tokenize the inputs
-    inputs = tokenizer(reviews, return_tensors="pt", padding=True, truncation=True, max_length=512)
-    inputs = {k: v.to(model.device) for k, v in inputs.items()}
-
-    # Create DataLoader for batching
-    dataset = torch.utils.data.TensorDataset(inputs['input_ids'], inputs['attention_mask'])
-    dataloader = DataLoader(dataset, batch_size=batch_size)
-
-    all_predictions = []
-    all_probs = []
-
-    # Perform inference
-    model.eval()
-    with torch.no_grad():
-        total_batches = len(dataloader)
-        i = 0
-        for batch in tqdm(dataloader, desc="Inferring sentiments..."):
-            input_ids, attention_mask = batch
-            outputs = model(input_ids, attention_mask=attention_mask)
-            logits = outputs.logits
-
-            # Get the predicted sentiment (0 = negative, 1 = positive)
-            predictions = torch.argmax(logits, dim=-1)
-            all_predictions.extend(predictions.cpu().numpy())
-
-            # Convert to probabilities
-            probs = F.softmax(logits, dim=-1)
-            all_probs.extend(probs.cpu().numpy())
-
-            # Yield progress
-            yield json.dumps({"progress": int((i / total_batches) * 100)})
-            i += 1
-
-    # Yield the final result with predictions and probabilities
+    # Reviews this model has labeled before come from the cache; the rest go to the model, once per distinct text
+    model_id = batcher.model.model_id
+    keys = [review_key(model_id, review) for review in reviews]
+    results = cache.get_many(keys) if cache is not None else {}
+    cache_hits = sum(key in results for key in keys)
+    cache_hit_rate = round(cache_hits / len(keys), 3) if keys else None
+    misses = {key: review for key, review in zip(keys, reviews) if key not in results}
+    distinct = len(results) + len(misses)
+    yield json.dumps({"progress": int((len(results) / distinct) * 100) if distinct else 0,
+                      "cache_hits": cache_hits, "cache_hit_rate": cache_hit_rate})
+
+    # Queue the misses with those of the other requests in flight; the batcher forms the batches
+    futures = dict(zip(misses, batcher.submit(list(misses.values()))))
+    try:
+        # Yield progress as the reviews come back
+        progress = None
+        for done, _ in enumerate(tqdm(as_completed(futures.values()), total=len(futures),
+                                      desc="Inferring sentiments..."), start=1):
+            if int(((len(results) + done) / distinct) * 100) != progress:
+                progress = int(((len(results) + done) / distinct) * 100)
+                yield json.dumps({"progress": progress, "cache_hit_rate": cache_hit_rate})
+
+        # Get the predicted sentiment (0 = negative, 1 = positive) and the probabilities
+        results.update((key, future.result()) for key, future in futures.items())
+    finally:
+        # Closed early (the client went away) or a batch failed: drop the reviews still queued,
+        # but keep what the model already labeled
+        for future in futures.values():
+            future.cancel()
+        if cache is not None:
+            cache.put_many({key: future.result() for key, future in futures.items()
+                            if future.done() and not future.cancelled() and future.exception() is None}, model_id)
+
+    # Yield the final result with predictions and probabilities, in review order
     yield json.dumps({
-        'all_predictions': np.array(all_predictions).tolist(),
-        'all_probs': np.array(all_probs).tolist()
+        'all_predictions': [int(results[key][0]) for key in keys],
+        'all_probs': np.array([results[key][1] for key in keys]).tolist(),
+        'cache_hits': cache_hits,
+        'cache_hit_rate': cache_hit_rate,
     })
 
 # Extract cons and pros from the top reviews
@@ -143,22 +145,16 @@ def get_pros_cons(reviews, n_top=10):
 
     return j_response['pros'], j_response['cons'], j_response['summary']
 
-def analyze_sentiment(data):
-    model_name = "siebert/sentiment-roberta-large-english"
-
-    # Load tokenizer and model
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-
-    # Enable FP16 inference if a GPU is available
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
-
+def analyze_sentiment(data, batcher, cache=None):
+    """
+    Label the reviews through the server's MicroBatcher, taking those labeled
+    before from the SentimentCache, yielding progress updates, then the result.
+    """
     predicted_rating = None
     probs = None
 
     # Process the progress and final result
-    for progress_update in batch_inference_sentiment_roberta(data['review_body'], model, tokenizer, batch_size=2):
+    for progress_update in batch_inference_sentiment_roberta(data['review_body'], batcher, cache):
         progress_data = json.loads(progress_update)
 
         if 'all_predictions' in progress_data:
@@ -173,9 +169,6 @@ def analyze_sentiment(data):
 
     # Cleanup
     del data
-    model.cpu()
-    del model
-    del tokenizer
 
     # Yield the final result
     yield json.dumps({'result': result.to_json(orient='records')})
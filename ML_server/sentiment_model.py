@@ -0,0 +1,124 @@
+import threading
+import time
+import traceback
+
+import torch
+from transformers import AutoConfig, AutoTokenizer
+
+import backends
+
+MODEL_NAME = "siebert/sentiment-roberta-large-english"
+MAX_LENGTH = 512  # Tokens per review the model takes; longer reviews are truncated
+# Run through the model once at startup, so the first request does not pay for the lazy initialization
+WARMUP_REVIEWS = ["great product works exactly as described", "stopped working after a week do not buy"]
+
+
+class SentimentModel:
+    """
+    The sentiment tokenizer and model, loaded once at startup and kept in
+    memory for the life of the server. Requests share them: tokenizer calls
+    and forward passes each take a lock (the fast tokenizer is not safe to
+    call from several threads at once), so concurrent requests take turns
+    batch by batch instead of contending for the same cores (or GPU memory)
+    with a copy each.
+
+    `backend` picks how the model runs (see backends.BACKENDS); every backend
+    but fp32 runs on the CPU from an artifact made by export_model.py.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, device=None, backend='fp32', artifact_dir=backends.ARTIFACT_DIR):
+        self.model_name = model_name
+        self.backend = backend
+        self.artifact_dir = artifact_dir
+        cuda = backend == 'fp32' and torch.cuda.is_available()
+        self.device = device or torch.device("cuda" if cuda else "cpu")
+        self.tokenizer = None
+        self.run = None
+        self.artifact = None
+        self.revision = None
+        self.ready = threading.Event()
+        self.error = None
+        self.load_s = None
+        self.counters = {'batches': 0, 'reviews': 0, 'infer_s': 0.0}
+        self._lock = threading.Lock()
+        self._tokenizer_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+
+    def start(self):
+        """Load the model in a background thread; `ready` is set once it is warm."""
+        threading.Thread(target=self.load, name='sentiment-model', daemon=True).start()
+        return self
+
+    def load(self):
+        start = time.perf_counter()
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, use_fast=True)
+            # The hub commit of the weights, None for a local directory
+            self.revision = getattr(AutoConfig.from_pretrained(self.model_name), '_commit_hash', None)
+            self.run = backends.load(self.model_name, self.backend, self.device, self.artifact_dir)
+            if self.backend != 'fp32':
+                self.artifact = backends.artifact_meta(self.model_name, self.backend, self.artifact_dir)
+            self.predict(self.tokenize(WARMUP_REVIEWS))
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            return self
+        self.load_s = round(time.perf_counter() - start, 1)
+        self.ready.set()
+        print(f"Sentiment model {self.model_name} ({self.backend}) loaded on {self.device} in {self.load_s} s")
+        return self
+
+    @property
+    def model_id(self):
+        """Identifies what the model outputs: a new revision, backend, export or max length changes it."""
+        exported_at = (self.artifact or {}).get('exported_at')
+        return ':'.join(str(part) for part in (self.model_name, self.revision, self.backend, MAX_LENGTH, exported_at)
+                        if part is not None)
+
+    def tokenize(self, reviews):
+        """The reviews as one batch of tensors, padded to the longest of them."""
+        return self.pad(self.encode(reviews))
+
+    def encode(self, reviews):
+        """Token ids of each review, truncated to MAX_LENGTH but not padded."""
+        with self._tokenizer_lock:
+            return self.tokenizer(list(reviews), truncation=True, max_length=MAX_LENGTH)['input_ids']
+
+    def pad(self, encoded):
+        """A batch of tensors from encoded reviews, padded only to the longest review in the batch."""
+        length = max(len(ids) for ids in encoded)
+        input_ids = torch.full((len(encoded), length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(encoded), length), dtype=torch.long)
+        for i, ids in enumerate(encoded):
+            input_ids[i, :len(ids)] = torch.tensor(ids)
+            attention_mask[i, :len(ids)] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+    def predict(self, inputs):
+        """Predicted labels (0 = negative, 1 = positive) and class probabilities of a tokenized batch."""
+        with self._lock:
+            start = time.perf_counter()
+            logits = self.run(inputs['input_ids'], inputs['attention_mask'])
+            elapsed = time.perf_counter() - start
+        with self._counter_lock:
+            self.counters['batches'] += 1
+            self.counters['reviews'] += len(logits)
+            self.counters['infer_s'] += elapsed
+        return logits.argmax(axis=-1), backends.softmax(logits)
+
+    def stats(self):
+        with self._counter_lock:
+            counters = dict(self.counters)
+        counters['infer_s'] = round(counters['infer_s'], 2)
+        return {
+            'model': self.model_name,
+            'backend': self.backend,
+            'model_id': self.model_id,
+            'device': str(self.device),
+            'ready': self.ready.is_set(),
+            'error': self.error,
+            'load_s': self.load_s,
+            # Export details and the last parity check against fp32 (benchmarks/compare_backends.py)
+            'artifact': self.artifact,
+            **counters,
+        }
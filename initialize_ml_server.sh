@@ -22,5 +22,5 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 # Run Price Predictor server
-nohup python price_predictor.py &
+nohup python predictor_server.py &
 deactivate
@@ -1,4 +1,4 @@
 pkill -f ml_server.py
-pkill -f price_predictor.py
+pkill -f predictor_server.py
 pkill -f web_server.py
 pkill -f home.py
@@ -0,0 +1,73 @@
+"""
+Throughput of concurrent price predictions for the thread engine and for the
+process engine at increasing worker counts.
+
+Every configuration starts with an empty model cache, so each request pays for a
+full Prophet fit. Run from the price_predictor directory:
+
+    python benchmarks/bench_engine.py --items 32 --clients 16
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_predictor as pp  # noqa: E402
+from forecasting import ForecastEngine  # noqa: E402
+from serverutils.threading import get_optimal_process_count  # noqa: E402
+
+
+def run_load(items, clients, time_period):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(lambda item: pp.run_price_predictor(item, time_period, None), items))
+    return time.perf_counter() - start
+
+
+def bench(mode, workers, items, clients, time_period):
+    cache_dir = tempfile.mkdtemp(prefix='bench_models_')
+    engine = ForecastEngine(mode, workers, cache_dir, max_models=len(items)).start()
+    pp.engine = engine
+    try:
+        elapsed = run_load(items, clients, time_period)
+    finally:
+        engine.shutdown()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=32, help='number of distinct items to forecast')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent requests in flight')
+    parser.add_argument('--time-period', type=int, default=30)
+    parser.add_argument('--max-workers', type=int, default=get_optimal_process_count())
+    args = parser.parse_args()
+
+    items = pp.data_store.item_codes('super_market_prices')[:args.items]
+
+    worker_counts = []
+    workers = 1
+    while workers < args.max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(args.max_workers)
+
+    print(f"{len(items)} fits, {args.clients} concurrent clients, {os.cpu_count()} logical CPUs")
+    print(f"{'engine':<10}{'workers':>8}{'seconds':>10}{'fits/s':>9}{'speedup':>9}")
+
+    baseline = bench('thread', 1, items, args.clients, args.time_period)
+    print(f"{'thread':<10}{'-':>8}{baseline:>10.2f}{len(items) / baseline:>9.2f}{1:>9.2f}")
+
+    for workers in worker_counts:
+        elapsed = bench('process', workers, items, args.clients, args.time_period)
+        print(f"{'process':<10}{workers:>8}{elapsed:>10.2f}{len(items) / elapsed:>9.2f}{baseline / elapsed:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
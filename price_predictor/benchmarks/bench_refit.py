@@ -0,0 +1,121 @@
+"""
+Warm-started against cold Prophet refits after new history is appended.
+
+For each item the model is first fitted on its history without the last
+`--appended` days, as it was before the data drop. The full history is then
+refitted twice, cold and warm-started from that model. The report gives both
+refit times and the drift between their forecasts over the next `--horizon`
+days (mean and max absolute difference, relative to the mean cold forecast).
+Drift alone does not say which fit is off. lp_gain is the warm fit's log
+posterior minus the cold one's: positive means the warm start found the better
+optimum. Run from the price_predictor directory:
+
+    python benchmarks/bench_refit.py --items 20 --appended 7 --out refit_benchmark.csv
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_predictor as pp  # noqa: E402
+from forecasting import fit_model, window_dates  # noqa: E402
+
+
+def predict(model, item_data, dates):
+    future = pd.DataFrame({'ds': dates, 'cap': item_data['cap'].iloc[0], 'floor': 0})
+    model.uncertainty_samples = 0
+    return model.predict(future)['yhat'].to_numpy()
+
+
+def log_posterior(model):
+    return float(model.stan_fit.optimized_params_dict['lp__'])
+
+
+def timed_fit(item_data, previous=None):
+    start = time.perf_counter()
+    model = fit_model(item_data, previous)
+    return model, (time.perf_counter() - start) * 1000
+
+
+def bench_item(prepare, product_id, appended, horizon):
+    _, item_data = prepare(product_id)
+    cutoff = item_data['ds'].max() - pd.Timedelta(days=appended)
+    before = item_data[item_data['ds'] <= cutoff]
+    if len(before) < 30 or len(before) == len(item_data):
+        return None
+
+    previous, _ = timed_fit(before)
+    cold, cold_ms = timed_fit(item_data)
+    warm, warm_ms = timed_fit(item_data, previous)
+
+    dates = window_dates(item_data['ds'].max(), horizon)
+    cold_forecast = predict(cold, item_data, dates)
+    warm_forecast = predict(warm, item_data, dates)
+    scale = max(np.mean(np.abs(cold_forecast)), 1e-9)
+    drift = np.abs(warm_forecast - cold_forecast) / scale
+    return {
+        'item_code': product_id,
+        'rows': len(item_data),
+        'appended_rows': len(item_data) - len(before),
+        'cold_ms': cold_ms,
+        'warm_ms': warm_ms,
+        'speedup': cold_ms / warm_ms,
+        'drift_mean': float(drift.mean()),
+        'drift_max': float(drift.max()),
+        'lp_gain': log_posterior(warm) - log_posterior(cold),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', choices=['price', 'demand'], default='price')
+    parser.add_argument('--items', type=int, default=20, help='benchmark the first N items')
+    parser.add_argument('--appended', type=int, default=7, help='days of history appended since the last fit')
+    parser.add_argument('--horizon', type=int, default=90, help='days of forecast compared for drift')
+    parser.add_argument('--out', default=None, help='also write the per-item results to this CSV')
+    args = parser.parse_args()
+
+    # Prophet/cmdstanpy log every fit
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    logging.getLogger('prophet').setLevel(logging.ERROR)
+
+    prepare = pp.prediction_preparers[args.dataset]
+    items = pp.data_store.item_codes(pp.prediction_datasets[args.dataset])[:args.items]
+
+    rows = []
+    for i, product_id in enumerate(items, 1):
+        try:
+            row = bench_item(prepare, product_id, args.appended, args.horizon)
+        except Exception as e:
+            print(f"[{i}/{len(items)}] {product_id}: skipped ({e})")
+            continue
+        if row is None:
+            continue
+        rows.append(row)
+        print(f"[{i}/{len(items)}] {product_id}: cold {row['cold_ms']:.0f} ms, warm {row['warm_ms']:.0f} ms, "
+              f"drift {row['drift_mean']:.2%} mean / {row['drift_max']:.2%} max, lp gain {row['lp_gain']:+.2f}")
+
+    report = pd.DataFrame(rows)
+    if report.empty:
+        print("No item had enough history to benchmark")
+        return
+    if args.out:
+        report.to_csv(args.out, index=False)
+
+    print(f"\n{len(report)} items, {args.appended} days appended")
+    print(f"total refit time: cold {report['cold_ms'].sum() / 1000:.1f} s, warm {report['warm_ms'].sum() / 1000:.1f} s "
+          f"({report['cold_ms'].sum() / report['warm_ms'].sum():.2f}x)")
+    print(f"median speedup {report['speedup'].median():.2f}x, "
+          f"median drift {report['drift_mean'].median():.2%}, worst drift {report['drift_max'].max():.2%}")
+    # Optimizer tolerance leaves small differences either way
+    print(f"warm fit at least as good as cold for {(report['lp_gain'] > -1).sum()} of {len(report)} items")
+
+
+if __name__ == '__main__':
+    main()
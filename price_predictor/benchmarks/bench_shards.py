@@ -0,0 +1,183 @@
+"""
+Local sharding test. Starts `--shards` predictor instances on consecutive ports
+and sends a skewed stream of point queries through the web server's
+consistent-hash router (web_server/shard_router.py). For each phase it reports
+the share of model lookups the shards answered from memory.
+
+Phases:
+  hashed k/N   route over the first k shards, for k = 1..N. 'first pass' is the
+               hit rate right after the shard was added (only the items that
+               moved to it miss), 'steady' the rate once it has settled
+  random N     the same stream spread over all N shards at random, for comparison
+  shard down   the last shard is stopped mid-run; its items move to the others
+
+Each shard keeps at most `--cache-size` models in memory, so a single shard
+cannot hold every item. Shards run with PREDICTOR_ENGINE=thread, which makes
+their model cache counters visible in /stats. Run from the price_predictor
+directory:
+
+    python benchmarks/bench_shards.py --shards 3 --items 60 --cache-size 24
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'web_server'))
+
+from shard_router import ShardRouter, _hash  # noqa: E402
+
+# Far beyond any materialized forecast, so every query needs the item's model
+QUERY_DATE = '2026-01-01'
+
+
+def start_shards(ports, cache_size, log_dir):
+    env = {**os.environ, 'PREDICTOR_ENGINE': 'thread', 'MODEL_CACHE_SIZE': str(cache_size)}
+    processes = []
+    for port in ports:
+        log = open(os.path.join(log_dir, f'shard-{port}.log'), 'w')
+        processes.append(subprocess.Popen([sys.executable, 'predictor_server.py', '--port', str(port),
+                                           '--warm-models', '0'], cwd=HERE, env=env, stdout=log,
+                                          stderr=subprocess.STDOUT))
+    for port in ports:
+        for _ in range(120):
+            try:
+                if requests.get(f'http://localhost:{port}/ready', timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(1)
+        else:
+            raise RuntimeError(f"Shard on port {port} did not become ready, see {log_dir}")
+    return processes
+
+
+def model_counters(url):
+    cache = requests.get(f'{url}/stats', timeout=5).json()['engine']['model_cache']
+    return cache['hits'], cache['disk_hits'] + cache['misses']
+
+
+def send(urls, item_code, on_down=None):
+    """Query the first shard in urls that answers. Returns whether the query succeeded."""
+    for url in urls:
+        try:
+            response = requests.post(f'{url}/predict_points', timeout=120, json={
+                'prediction_type': 'price', 'product_id': item_code, 'dates': QUERY_DATE, 'engine': 'prophet'})
+        except requests.ConnectionError:
+            if on_down is not None:
+                on_down(url)
+            continue
+        return response.status_code == 200
+    return False
+
+
+def run_phase(stream, pick, urls, clients, on_down=None):
+    """
+    Send the stream, trying the shards pick(item) returns in order. Returns the
+    share of model lookups the live shards among urls answered from memory, and
+    the number of failed requests.
+    """
+    before = {}
+    for url in urls:
+        try:
+            before[url] = model_counters(url)
+        except requests.RequestException:
+            pass
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        failed = sum(not ok for ok in pool.map(lambda item: send(pick(item), item, on_down), stream))
+
+    hits = lookups = 0
+    for url, (hits_before, loads_before) in before.items():
+        try:
+            hits_after, loads_after = model_counters(url)
+        except requests.RequestException:
+            continue
+        hits += hits_after - hits_before
+        lookups += hits_after + loads_after - hits_before - loads_before
+    return (hits / lookups if lookups else None), failed
+
+
+def moved_share(items, old, new):
+    """Share of items whose shard changes from old to new urls, on the ring and with hash % N."""
+    old_ring, new_ring = ShardRouter(old), ShardRouter(new)
+    ring = sum(old_ring.shards_for(item)[0] != new_ring.shards_for(item)[0] for item in items)
+    modulo = sum(_hash(item) % len(old) != _hash(item) % len(new) for item in items)
+    return ring / len(items), modulo / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=3)
+    parser.add_argument('--items', type=int, default=60, help='distinct items requested')
+    parser.add_argument('--requests', type=int, default=300, help='requests per phase')
+    parser.add_argument('--cache-size', type=int, default=24, help='models each shard keeps in memory')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent requests')
+    parser.add_argument('--base-port', type=int, default=5102)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    import price_predictor as pp
+    items = pp.data_store.item_codes('super_market_prices')[:args.items]
+    # A few items get most of the traffic, as on the site
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(items))]
+    rng = random.Random(0)
+
+    ports = [args.base_port + i for i in range(args.shards)]
+    urls = [f'http://localhost:{port}' for port in ports]
+    log_dir = tempfile.mkdtemp(prefix='bench_shards_')
+    print(f"Starting {args.shards} shards on ports {ports[0]}-{ports[-1]} (logs in {log_dir})")
+    processes = start_shards(ports, args.cache_size, log_dir)
+    try:
+        # Fit every model once so later misses load it from the shared disk store instead of fitting
+        run_phase(items, lambda item: urls[:1], urls[:1], args.clients)
+
+        def stream(n=args.requests):
+            return rng.choices(items, weights, k=n)
+
+        results = []
+        for k in range(1, args.shards + 1):
+            pick = ShardRouter(urls[:k]).shards_for
+            first, _ = run_phase(stream(), pick, urls[:k], args.clients)
+            steady, failed = run_phase(stream(), pick, urls[:k], args.clients)
+            moved = moved_share(items, urls[:k - 1], urls[:k]) if k > 1 else (None, None)
+            results.append((f'hashed {k}/{args.shards}', first, steady, failed, moved))
+
+        def pick_random(item):
+            return [rng.choice(urls)]
+
+        run_phase(stream(), pick_random, urls, args.clients)
+        steady, failed = run_phase(stream(), pick_random, urls, args.clients)
+        results.append((f'random {args.shards}', None, steady, failed, (None, None)))
+
+        # Requests to the stopped shard fail over along the ring; the health checks keep it skipped
+        router = ShardRouter(urls, interval=1).start()
+        run_phase(stream(), router.shards_for, urls, args.clients, router.mark_down)
+        processes[-1].terminate()
+        processes[-1].wait()
+        first, failed = run_phase(stream(), router.shards_for, urls, args.clients, router.mark_down)
+        steady, failed_after = run_phase(stream(), router.shards_for, urls, args.clients, router.mark_down)
+        results.append(('shard down', first, steady, failed + failed_after, moved_share(items, urls, urls[:-1])))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    def rate(value):
+        return f'{value:7.1%}' if value is not None else '      -'
+
+    print(f"\n{'phase':<14}{'first pass':>11}{'steady':>9}{'failed':>8}{'moved (ring)':>14}{'moved (mod N)':>15}")
+    for phase, first, steady, failed, (ring, modulo) in results:
+        print(f"{phase:<14}{rate(first):>11}{rate(steady):>9}{failed:>8}{rate(ring):>14}{rate(modulo):>15}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Accuracy and latency of the fast NumPy engine against Prophet, per item.
+
+Each item's prepared history (the same preprocessing the predictor uses) is
+split at `--holdout` days before its last date. Both engines are fitted on the
+earlier part and scored on the held-out days. The report lists MAPE, MAE and
+fit+predict time per item and recommends 'fast' where its MAPE is within
+`--tolerance` of Prophet's. Run from the price_predictor directory:
+
+    python benchmarks/compare_engines.py --dataset price --holdout 30 --out engine_comparison.csv
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_predictor as pp  # noqa: E402
+from fast_forecast import fast_fit_predict  # noqa: E402
+from forecasting import build_model, window_dates  # noqa: E402
+
+
+def prophet_fit_predict(item_data, dates):
+    model = build_model()
+    model.fit(item_data)
+    future = pd.DataFrame({'ds': dates, 'cap': item_data['cap'].iloc[0], 'floor': 0})
+    return model.predict(future)[['ds', 'yhat']]
+
+
+def score(forecast, actual):
+    merged = actual.merge(forecast, on='ds')
+    errors = np.abs(merged['yhat'] - merged['y'])
+    nonzero = merged['y'] != 0
+    return float(np.mean(errors[nonzero] / merged['y'][nonzero])), float(np.mean(errors))
+
+
+def compare_item(prepare, product_id, holdout):
+    _, item_data = prepare(product_id)
+    cutoff = item_data['ds'].max() - pd.Timedelta(days=holdout)
+    train = item_data[item_data['ds'] <= cutoff]
+    actual = item_data[item_data['ds'] > cutoff][['ds', 'y']]
+    if len(train) < 30 or actual.empty:
+        return None
+
+    # Gaps in the history can leave the last training day well before the cutoff
+    dates = window_dates(train['ds'].max(), (actual['ds'].max() - train['ds'].max()).days)
+
+    row = {'item_code': product_id, 'train_rows': len(train), 'test_rows': len(actual)}
+    for name, fit_predict in (('prophet', prophet_fit_predict), ('fast', fast_fit_predict)):
+        start = time.perf_counter()
+        forecast = fit_predict(train, dates)
+        row[f'{name}_ms'] = (time.perf_counter() - start) * 1000
+        row[f'{name}_mape'], row[f'{name}_mae'] = score(forecast, actual)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', choices=['price', 'demand'], default='price')
+    parser.add_argument('--holdout', type=int, default=30, help='days held out for scoring')
+    parser.add_argument('--items', type=int, default=None, help='only compare the first N items')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative MAPE increase accepted before preferring Prophet")
+    parser.add_argument('--out', default='engine_comparison.csv')
+    args = parser.parse_args()
+
+    # Prophet/cmdstanpy log every fit
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    logging.getLogger('prophet').setLevel(logging.ERROR)
+
+    data_name = pp.prediction_datasets[args.dataset]
+    prepare = pp.prepare_price_data if args.dataset == 'price' else pp.prepare_demand_data
+    items = pp.data_store.item_codes(data_name)[:args.items]
+
+    rows = []
+    for i, product_id in enumerate(items, 1):
+        try:
+            row = compare_item(prepare, product_id, args.holdout)
+        except Exception as e:
+            print(f"[{i}/{len(items)}] {product_id}: skipped ({e})")
+            continue
+        if row is None:
+            continue
+        rows.append(row)
+        print(f"[{i}/{len(items)}] {product_id}: prophet {row['prophet_mape']:.3f} in {row['prophet_ms']:.0f} ms, "
+              f"fast {row['fast_mape']:.3f} in {row['fast_ms']:.1f} ms")
+
+    report = pd.DataFrame(rows)
+    if report.empty:
+        print("No item had enough history to compare")
+        return
+    report['recommended'] = np.where(report['fast_mape'] <= report['prophet_mape'] * (1 + args.tolerance),
+                                     'fast', 'prophet')
+    report.to_csv(args.out, index=False)
+
+    print(f"\n{len(report)} items, report written to {args.out}")
+    print(f"median MAPE:    prophet {report['prophet_mape'].median():.3f}, fast {report['fast_mape'].median():.3f}")
+    print(f"median latency: prophet {report['prophet_ms'].median():.0f} ms, fast {report['fast_ms'].median():.1f} ms")
+    print(f"fast recommended for {(report['recommended'] == 'fast').sum()} of {len(report)} items")
+
+
+if __name__ == '__main__':
+    main()
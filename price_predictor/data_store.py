@@ -0,0 +1,324 @@
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Lines read at a time when streaming a transaction log into daily totals
+CHUNK_ROWS = 500_000
+
+
+class Dataset:
+    """One dataset held as item-sorted columns plus a per-item row index."""
+
+    def __init__(self, ds, y, item_codes, offsets, checksum, stat):
+        self.ds = ds                  # datetime64[ns], sorted by (item, date)
+        self.y = y                    # float64 values
+        self.item_codes = item_codes  # unique item codes as str, in row order
+        self.offsets = offsets        # item i occupies rows offsets[i]:offsets[i + 1]
+        self.checksum = checksum
+        self.stat = stat
+        self.index = {code: i for i, code in enumerate(item_codes)}
+        self._item_versions = {}
+
+        # The arrays are shared by every request thread, never let one of them write into it
+        for array in (self.ds, self.y, self.offsets):
+            array.flags.writeable = False
+
+    @property
+    def nbytes(self):
+        return self.ds.nbytes + self.y.nbytes + self.offsets.nbytes
+
+    def item_slice(self, item_code):
+        i = self.index.get(item_code)
+        if i is None:
+            return slice(0, 0)
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def item_version(self, item_code):
+        version = self._item_versions.get(item_code)
+        if version is None:
+            rows = self.item_slice(item_code)
+            digest = hashlib.sha1(self.ds[rows].view('int64').tobytes())
+            digest.update(self.y[rows].tobytes())
+            version = digest.hexdigest()[:16]
+            self._item_versions[item_code] = version
+        return version
+
+
+class _Appended:
+    """Rows ingested for one item on top of its dataset file, date-sorted."""
+
+    def __init__(self, ds, y):
+        self.ds = ds
+        self.y = y
+        digest = hashlib.sha1(ds.view('int64').tobytes())
+        digest.update(y.tobytes())
+        self.digest = digest.hexdigest()[:16]
+        for array in (self.ds, self.y):
+            array.flags.writeable = False
+
+
+def _file_stat(file_path):
+    st = os.stat(file_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _file_checksum(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DataStore:
+    """
+    Loads every dataset once and serves per-item series as zero-copy slices.
+
+    Parsed columns are cached next to the CSV in a .npz file, which is reused as
+    long as the checksum of the CSV it was built from still matches.
+
+    Datasets in daily_totals are transaction logs: they are streamed in chunks of
+    CHUNK_ROWS lines and kept as one non-negative total per item and day, so the
+    file may be larger than memory.
+
+    Rows ingested later are kept per item on top of the file and written to an
+    append log in log_dir, which is replayed on the next start. The CSV itself
+    is never rewritten.
+    """
+
+    def __init__(self, file_mapping, column_names, log_dir=None, daily_totals=()):
+        self.file_mapping = file_mapping
+        self.column_names = column_names
+        self.log_dir = log_dir
+        self.daily_totals = set(daily_totals)
+        self._datasets = {}
+        self._lock = threading.Lock()
+        # data_name -> {item_code: _Appended}. Replaced as a whole on every append, so readers need no lock.
+        self._appended = {}
+        self._append_lock = threading.Lock()
+
+    def preload(self):
+        for data_name in self.file_mapping:
+            try:
+                dataset = self.dataset(data_name)
+                logging.info(f"Loaded {data_name}: {len(dataset.y)} rows, "
+                             f"{len(dataset.item_codes)} items, {dataset.nbytes / 1024:.0f} KiB")
+            except FileNotFoundError:
+                logging.warning(f"Data file for {data_name} not found: {self.file_mapping[data_name]}")
+
+    def dataset(self, data_name):
+        file_path = self.file_mapping[data_name]
+        dataset = self._datasets.get(data_name)
+        if dataset is not None and dataset.stat == _file_stat(file_path):
+            return dataset
+
+        with self._lock:
+            dataset = self._datasets.get(data_name)
+            stat = _file_stat(file_path)
+            if dataset is None or dataset.stat != stat:
+                if dataset is None:
+                    self._replay_log(data_name)
+                dataset = self._load(data_name, stat)
+                self._datasets[data_name] = dataset
+        return dataset
+
+    def version(self, data_name):
+        checksum = self.dataset(data_name).checksum
+        appended = self._appended.get(data_name)
+        if not appended:
+            return checksum
+        return f'{checksum}+{sum(len(entry.y) for entry in appended.values())}'
+
+    def item_version(self, data_name, item_code):
+        version = self.dataset(data_name).item_version(item_code)
+        appended = self._appended.get(data_name, {}).get(item_code)
+        if appended is None:
+            return version
+        return hashlib.sha1(f'{version}+{appended.digest}'.encode()).hexdigest()[:16]
+
+    def item_codes(self, data_name):
+        dataset = self.dataset(data_name)
+        new_codes = [code for code in self._appended.get(data_name, {}) if code not in dataset.index]
+        return list(dataset.item_codes) + sorted(new_codes)
+
+    def get_item(self, data_name, item_code):
+        """Return the ('ds', 'y') rows of one item, backed by views into the store unless rows were appended."""
+        dataset = self.dataset(data_name)
+        rows = dataset.item_slice(item_code)
+        appended = self._appended.get(data_name, {}).get(item_code)
+        if appended is None:
+            return pd.DataFrame({'ds': dataset.ds[rows], 'y': dataset.y[rows]}, copy=False)
+
+        ds = np.concatenate((dataset.ds[rows], appended.ds))
+        y = np.concatenate((dataset.y[rows], appended.y))
+        order = np.argsort(ds, kind='stable')
+        return pd.DataFrame({'ds': ds[order], 'y': y[order]}, copy=False)
+
+    def append(self, data_name, rows):
+        """
+        Append rows with the dataset's Date, Item Code and value columns ('value'
+        also names the latter). The rows reach the append log before they become
+        visible. Returns the codes of the items that got rows.
+        """
+        frame = self._normalize_rows(data_name, rows)
+        self.dataset(data_name)  # Replay the log first, the new rows go after it
+        with self._append_lock:
+            self._write_log(data_name, frame)
+            return self._apply(data_name, frame)
+
+    def appended_rows(self, data_name):
+        return sum(len(entry.y) for entry in self._appended.get(data_name, {}).values())
+
+    def _normalize_rows(self, data_name, rows):
+        columns = {**self.column_names[data_name], 'value': 'y', 'Item Code': 'item_code'}
+        frame = rows.rename(columns=columns)
+        missing = [name for name, column in columns.items() if column != 'y' and column not in frame.columns]
+        if 'y' not in frame.columns:
+            missing.append('value')
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        frame = pd.DataFrame({
+            'ds': pd.to_datetime(frame['ds']).to_numpy(dtype='datetime64[ns]'),
+            'item_code': frame['item_code'].astype(str).str.strip().to_numpy(dtype=object),
+            'y': pd.to_numeric(frame['y']).to_numpy(dtype='float64'),
+        })
+        if not np.isfinite(frame['y']).all():
+            raise ValueError("Values must be finite numbers")
+        if (frame['item_code'] == '').any():
+            raise ValueError("Every row needs an Item Code")
+        return frame
+
+    def _log_path(self, data_name):
+        return os.path.join(self.log_dir, f'{data_name}.csv')
+
+    def _write_log(self, data_name, frame):
+        if self.log_dir is None:
+            return
+        os.makedirs(self.log_dir, exist_ok=True)
+        path = self._log_path(data_name)
+        text = frame.to_csv(header=not os.path.exists(path), index=False, date_format='%Y-%m-%d %H:%M:%S')
+        with open(path, 'a') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay_log(self, data_name):
+        if self.log_dir is None or not os.path.exists(self._log_path(data_name)):
+            return
+        # The default float parser can be off in the last digit, which would change the items' versions
+        frame = pd.read_csv(self._log_path(data_name), dtype={'item_code': str}, parse_dates=['ds'],
+                            float_precision='round_trip')
+        with self._append_lock:
+            self._apply(data_name, frame)
+        logging.info(f"Replayed {len(frame)} ingested rows of {data_name}")
+
+    def _apply(self, data_name, frame):
+        codes, item_codes = pd.factorize(frame['item_code'])
+        ds = frame['ds'].to_numpy(dtype='datetime64[ns]')
+        y = frame['y'].to_numpy(dtype='float64')
+        order = np.lexsort((ds, codes))
+        offsets = np.searchsorted(codes[order], np.arange(len(item_codes) + 1))
+
+        appended = dict(self._appended.get(data_name, {}))
+        for i, item_code in enumerate(item_codes):
+            rows = order[offsets[i]:offsets[i + 1]]
+            previous = appended.get(item_code)
+            if previous is None:
+                appended[item_code] = _Appended(ds[rows], y[rows])
+                continue
+            item_ds = np.concatenate((previous.ds, ds[rows]))
+            item_y = np.concatenate((previous.y, y[rows]))
+            item_order = np.argsort(item_ds, kind='stable')
+            appended[item_code] = _Appended(item_ds[item_order], item_y[item_order])
+        self._appended[data_name] = appended
+        return [str(item_code) for item_code in item_codes]
+
+    def _load(self, data_name, stat):
+        file_path = self.file_mapping[data_name]
+        cache_path = f'{file_path}.npz'
+        checksum = _file_checksum(file_path)
+        layout = 'daily_totals' if data_name in self.daily_totals else 'rows'
+
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    cached_layout = str(cached['layout']) if 'layout' in cached.files else 'rows'
+                    if str(cached['checksum']) == checksum and cached_layout == layout:
+                        return Dataset(cached['ds'].view('datetime64[ns]'), cached['y'],
+                                       [str(code) for code in cached['item_codes']],
+                                       cached['offsets'], checksum, stat)
+            except (OSError, KeyError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable cache {cache_path}: {e}")
+
+        if layout == 'daily_totals':
+            dataset = self._aggregate_csv(data_name, checksum, stat)
+        else:
+            dataset = self._parse_csv(data_name, checksum, stat)
+        self._write_cache(cache_path, dataset, layout)
+        return dataset
+
+    def _parse_csv(self, data_name, checksum, stat):
+        file_path = self.file_mapping[data_name]
+        columns = self.column_names[data_name]
+        data = pd.read_csv(file_path, usecols=[*columns, 'Item Code'],
+                           dtype={'Item Code': 'string'})
+        data = data.rename(columns=columns)
+
+        codes, item_codes = pd.factorize(data['Item Code'], sort=True)
+        ds = pd.to_datetime(data['ds']).to_numpy(dtype='datetime64[ns]')
+        y = data['y'].to_numpy(dtype='float64')
+
+        # Group the rows by item, keeping dates ascending and the file order for equal dates
+        order = np.lexsort((ds, codes))
+        offsets = np.searchsorted(codes[order], np.arange(len(item_codes) + 1)).astype('int64')
+
+        return Dataset(ds[order], y[order], [str(code) for code in item_codes],
+                       offsets, checksum, stat)
+
+    def _aggregate_csv(self, data_name, checksum, stat):
+        """Sum the non-negative lines of a transaction log per item and day, one chunk at a time."""
+        file_path = self.file_mapping[data_name]
+        columns = self.column_names[data_name]
+        partials = []
+        partial_rows = 0
+        for chunk in pd.read_csv(file_path, usecols=[*columns, 'Item Code'], dtype={'Item Code': 'string'},
+                                 chunksize=CHUNK_ROWS):
+            chunk = chunk.rename(columns=columns)
+            chunk = chunk[chunk['y'] >= 0]  # Returns are booked as negative quantities
+            # Group on the raw date text; only the distinct keys are parsed, once, at the end
+            daily = chunk.groupby(['Item Code', 'ds'], sort=False)['y'].sum()
+            partials.append(daily)
+            partial_rows += len(daily)
+            # Days spanning chunk boundaries appear in several partials; fold them before they pile up
+            if partial_rows > CHUNK_ROWS:
+                partials = [pd.concat(partials).groupby(level=[0, 1], sort=False).sum()]
+                partial_rows = len(partials[0])
+
+        if partials:
+            totals = pd.concat(partials).groupby(level=[0, 1], sort=False).sum()
+            days = pd.to_datetime(totals.index.get_level_values(1)).normalize()
+            totals = totals.groupby([totals.index.get_level_values(0), days], sort=True).sum()
+        else:
+            totals = pd.Series([], dtype='float64', index=pd.MultiIndex.from_arrays([[], pd.DatetimeIndex([])]))
+        codes, item_codes = pd.factorize(totals.index.get_level_values(0), sort=True)
+        offsets = np.searchsorted(codes, np.arange(len(item_codes) + 1)).astype('int64')
+
+        return Dataset(totals.index.get_level_values(1).to_numpy(dtype='datetime64[ns]'),
+                       totals.to_numpy(dtype='float64'), [str(code) for code in item_codes],
+                       offsets, checksum, stat)
+
+    @staticmethod
+    def _write_cache(cache_path, dataset, layout='rows'):
+        tmp_path = f'{cache_path}.tmp.npz'
+        try:
+            np.savez(tmp_path, ds=dataset.ds.view('int64'), y=dataset.y,
+                     item_codes=np.array(dataset.item_codes), offsets=dataset.offsets,
+                     checksum=np.array(dataset.checksum), layout=np.array(layout))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.warning(f"Could not write data cache {cache_path}: {e}")
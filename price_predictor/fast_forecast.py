@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+from forecasting import model_params, yearly_seasonality, forecast_columns
+
+# Same changepoint grid as Prophet's defaults
+N_CHANGEPOINTS = 25
+CHANGEPOINT_RANGE = 0.8
+# Reweighting rounds that turn the ridge penalty on the changepoints into an L1 (Laplace prior) one
+IRLS_ITERATIONS = 5
+
+# Normal quantile of a two-sided 80% interval, Prophet's default interval_width
+INTERVAL_Z = 1.2815515655446004
+
+_EPOCH = np.datetime64('1970-01-01', 'ns')
+_DAY = np.timedelta64(1, 'D')
+
+
+class FastModel:
+    """
+    A closed-form stand-in for the logistic Prophet model, fitted in milliseconds.
+
+    The target is mapped into the logit space of [floor, cap], where Prophet's
+    logistic trend is a piecewise-linear function of time. There it is fitted as
+    a linear trend with Prophet's changepoint grid plus yearly Fourier terms, by
+    penalized least squares: Laplace priors on the rate changes (via iteratively
+    reweighted ridge), Normal priors on the seasonality. Forecasts are mapped back
+    through the logistic function, so they stay inside (floor, cap).
+    """
+
+    def __init__(self, changepoint_prior_scale, seasonality_prior_scale, period, fourier_order):
+        self.changepoint_prior_scale = changepoint_prior_scale
+        self.seasonality_prior_scale = seasonality_prior_scale
+        self.period = period
+        self.fourier_order = fourier_order
+
+    @classmethod
+    def from_prophet_params(cls):
+        return cls(model_params['changepoint_prior_scale'], model_params['seasonality_prior_scale'],
+                   yearly_seasonality['period'], yearly_seasonality['fourier_order'])
+
+    def fit(self, item_data):
+        history = item_data.sort_values('ds')
+        ds = history['ds'].to_numpy(dtype='datetime64[ns]')
+        y = history['y'].to_numpy(dtype='float64')
+        if len(ds) < 2:
+            raise ValueError("Dataframe has less than 2 non-NaN rows.")
+
+        self.history_dates = np.unique(ds)
+        self.start = ds[0]
+        self.t_scale = max((ds[-1] - ds[0]) / _DAY, 1.0)
+        self.cap = float(history['cap'].iloc[0])
+        self.floor = float(history['floor'].iloc[0])
+
+        t = self._t(ds)
+        hist_size = int(np.floor(len(ds) * CHANGEPOINT_RANGE))
+        n_changepoints = min(N_CHANGEPOINTS, hist_size - 1)
+        if n_changepoints > 0:
+            cp_indexes = np.linspace(0, hist_size - 1, n_changepoints + 1).round().astype(int)
+            self.changepoints_t = t[cp_indexes][1:]
+        else:
+            self.changepoints_t = np.empty(0)
+
+        share = np.clip((y - self.floor) / (self.cap - self.floor), 1e-6, 1 - 1e-6)
+        z = np.log(share / (1 - share))
+
+        X = self._features(ds)
+        XtX = X.T @ X
+        Xtz = X.T @ z
+        trend_cols = slice(0, 2)
+        delta_cols = slice(2, 2 + len(self.changepoints_t))
+        beta_cols = slice(2 + len(self.changepoints_t), X.shape[1])
+
+        penalty = np.empty(X.shape[1])
+        sigma2 = max(float(np.var(z)), 1e-8)
+        delta = None
+        for _ in range(IRLS_ITERATIONS):
+            penalty[trend_cols] = sigma2 / 5 ** 2  # Prophet's Normal(0, 5) priors on k and m
+            if delta is None:
+                penalty[delta_cols] = sigma2 / self.changepoint_prior_scale ** 2
+            else:
+                penalty[delta_cols] = sigma2 / (self.changepoint_prior_scale * np.maximum(np.abs(delta), 1e-4))
+            penalty[beta_cols] = sigma2 / self.seasonality_prior_scale ** 2
+
+            self.theta = np.linalg.solve(XtX + np.diag(penalty), Xtz)
+            residuals = z - X @ self.theta
+            sigma2 = max(float(np.mean(residuals ** 2)), 1e-8)
+            delta = self.theta[delta_cols]
+
+        self.sigma = np.sqrt(sigma2)
+        return self
+
+    def predict_z(self, ds):
+        return self._features(ds) @ self.theta
+
+    def predict(self, ds, interval=False):
+        """
+        Forecast at ds. With interval=True also returns yhat_lower/yhat_upper from
+        the residual spread in logit space, which keeps the band inside (floor, cap)
+        but, unlike Prophet's sampled one, does not widen with the horizon.
+        """
+        ds = np.asarray(ds, dtype='datetime64[ns]')
+        z = self.predict_z(ds)
+        forecast = pd.DataFrame({'ds': ds, 'yhat': self._to_y(z)})
+        if interval:
+            forecast['yhat_lower'] = self._to_y(z - INTERVAL_Z * self.sigma)
+            forecast['yhat_upper'] = self._to_y(z + INTERVAL_Z * self.sigma)
+        return forecast
+
+    def _to_y(self, z):
+        return self.floor + (self.cap - self.floor) / (1 + np.exp(-z))
+
+    def _t(self, ds):
+        return (ds - self.start) / _DAY / self.t_scale
+
+    def _features(self, ds):
+        t = self._t(ds)
+        columns = [np.ones_like(t), t]
+        if len(self.changepoints_t):
+            columns.extend(np.maximum(t[:, None] - self.changepoints_t[None, :], 0).T)
+
+        days = (ds - _EPOCH) / _DAY
+        for order in range(1, self.fourier_order + 1):
+            angle = 2 * np.pi * order * days / self.period
+            columns.append(np.sin(angle))
+            columns.append(np.cos(angle))
+        return np.column_stack(columns)
+
+
+def fast_fit_predict(item_data, dates, uncertainty='none'):
+    """Counterpart of forecasting.fit_and_predict, refitting the fast model on every call."""
+    model = FastModel.from_prophet_params().fit(item_data)
+    return model.predict(dates, interval=uncertainty != 'none')[forecast_columns(uncertainty)]
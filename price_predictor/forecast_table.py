@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from forecasting import UNCERTAINTY_SAMPLES, forecast_columns
+
+_NS_PER_DAY = 86400 * 10 ** 9
+
+
+class ForecastTable:
+    """
+    Precomputed forecasts of one dataset, indexed by (item, date).
+
+    Rows are grouped by item and every item covers consecutive days, so a date
+    is found by its offset from the item's first forecast day, with no search.
+    """
+
+    def __init__(self, item_codes, versions, offsets, days, values, fit_ms, meta):
+        self.item_codes = item_codes  # str, one per item
+        self.versions = versions      # data version each item was fitted on
+        self.offsets = offsets        # item i occupies rows offsets[i]:offsets[i + 1]
+        self.days = days              # int32 days since the epoch
+        self.values = values          # forecast column -> float64 array
+        self.fit_ms = fit_ms          # fit + predict time of each item
+        self.meta = meta
+        self.index = {code: i for i, code in enumerate(item_codes)}
+
+    @classmethod
+    def from_forecasts(cls, forecasts, meta):
+        """forecasts: (item_code, data_version, forecast frame, fit_ms) per item."""
+        columns = forecast_columns(meta['uncertainty'])[1:]
+        lengths = [len(forecast) for _, _, forecast, _ in forecasts]
+        frames = [forecast for _, _, forecast, _ in forecasts]
+        combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ds', *columns])
+        return cls(
+            item_codes=np.array([str(item_code) for item_code, _, _, _ in forecasts], dtype=str),
+            versions=np.array([version for _, version, _, _ in forecasts], dtype=str),
+            offsets=np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+            days=(pd.to_datetime(combined['ds']).to_numpy(dtype='datetime64[ns]').view('int64')
+                  // _NS_PER_DAY).astype(np.int32),
+            values={column: combined[column].to_numpy(dtype='float64') for column in columns},
+            fit_ms=np.array([fit_ms for _, _, _, fit_ms in forecasts], dtype='float64'),
+            meta=meta,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as archive:
+            meta = json.loads(str(archive['meta']))
+            values = {column: archive[column] for column in forecast_columns(meta['uncertainty'])[1:]}
+            return cls(archive['item_codes'], archive['versions'], archive['offsets'], archive['days'],
+                       values, archive['fit_ms'], meta)
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, item_codes=self.item_codes, versions=self.versions, offsets=self.offsets, days=self.days,
+                     fit_ms=self.fit_ms, meta=np.array(json.dumps(self.meta)), **self.values)
+        os.replace(tmp_path, path)
+
+    def serves(self, engine_name, uncertainty):
+        return (self.meta['engine'] == engine_name and
+                UNCERTAINTY_SAMPLES[self.meta['uncertainty']] >= UNCERTAINTY_SAMPLES[uncertainty])
+
+    def lookup(self, item_code, version, dates, uncertainty):
+        """The item's forecast at dates, or None unless the table holds all of them for this data version."""
+        i = self.index.get(item_code)
+        if i is None or self.versions[i] != version:
+            return None
+        dates = pd.DatetimeIndex(dates)
+        ns = dates.asi8
+        if (ns % _NS_PER_DAY).any():
+            return None
+
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if start == end:
+            return None if len(dates) else pd.DataFrame(columns=forecast_columns(uncertainty))
+        rows = ns // _NS_PER_DAY - self.days[start] + start
+        if len(rows) and (rows.min() < start or rows.max() >= end):
+            return None
+
+        forecast = pd.DataFrame({'ds': dates})
+        for column in forecast_columns(uncertainty)[1:]:
+            forecast[column] = self.values[column][rows]
+        return forecast
+
+    def summary(self):
+        return {
+            **self.meta,
+            'items': len(self.item_codes),
+            'rows': len(self.days),
+            'fit_ms_median': float(np.median(self.fit_ms)) if len(self.fit_ms) else None,
+            'fit_ms_p95': float(np.percentile(self.fit_ms, 95)) if len(self.fit_ms) else None,
+            'fit_ms_max': float(self.fit_ms.max()) if len(self.fit_ms) else None,
+        }
+
+
+class ForecastTables:
+    """
+    The materialized forecast table of every dataset, picked up again whenever
+    the materialization job replaces a file, and counts of how requests fared.
+    """
+
+    def __init__(self, table_dir):
+        self.table_dir = table_dir
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'stale': 0, 'uncovered': 0, 'missing': 0}
+
+    def path(self, data_name):
+        return os.path.join(self.table_dir, f'{data_name}.npz')
+
+    def table(self, data_name):
+        path = self.path(data_name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stat = (st.st_mtime_ns, st.st_size)
+
+        cached = self._tables.get(data_name)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        with self._lock:
+            cached = self._tables.get(data_name)
+            if cached is None or cached[0] != stat:
+                try:
+                    table = ForecastTable.load(path)
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Could not load the forecast table {path}: {e}")
+                    return None
+                logging.info(f"Loaded the forecast table of {data_name}: {len(table.item_codes)} items")
+                cached = (stat, table)
+                self._tables[data_name] = cached
+        return cached[1]
+
+    def save(self, data_name, table):
+        os.makedirs(self.table_dir, exist_ok=True)
+        table.save(self.path(data_name))
+
+    def lookup(self, data_name, item_code, version, dates, engine_name, uncertainty):
+        table = self.table(data_name)
+        if table is None or item_code not in table.index:
+            outcome, forecast = 'missing', None
+        elif table.versions[table.index[item_code]] != version:
+            outcome, forecast = 'stale', None
+        else:
+            forecast = table.lookup(item_code, version, dates, uncertainty) \
+                if table.serves(engine_name, uncertainty) else None
+            outcome = 'uncovered' if forecast is None else 'hits'
+        with self._lock:
+            self.counters[outcome] += 1
+        return forecast
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        tables = {}
+        if os.path.isdir(self.table_dir):
+            for file_name in sorted(os.listdir(self.table_dir)):
+                table = self.table(file_name[:-len('.npz')]) if file_name.endswith('.npz') else None
+                if table is not None:
+                    tables[file_name[:-len('.npz')]] = table.summary()
+        return {'tables': tables, 'hit_rate': counters['hits'] / lookups if lookups else None, **counters}
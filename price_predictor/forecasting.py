@@ -0,0 +1,229 @@
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from prophet import Prophet
+
+from model_cache import ModelCache
+from serverutils.admission import current_priority
+from serverutils.cancellation import Cancelled, check_cancelled, current_token
+from serverutils.concurrency import ConcurrencyController
+from serverutils.process_pool import WorkerPool
+from serverutils.shared_frames import share_frame, read_frame, release
+
+# Prophet hyperparameters shared by the price and demand models
+model_params = {
+    'growth': 'logistic',
+    'changepoint_prior_scale': 0.05,  # Lower values make the model less sensitive to trend changes
+    'seasonality_prior_scale': 15,
+    'yearly_seasonality': True,       # Enable yearly seasonality by default
+    'weekly_seasonality': False,      # Disable weekly seasonality if irrelevant
+    'daily_seasonality': False,       # Disable daily seasonality if irrelevant
+}
+yearly_seasonality = {'name': 'yearly', 'period': 365.25, 'fourier_order': 12}
+
+# Posterior samples drawn for the yhat_lower/yhat_upper interval, per uncertainty mode
+UNCERTAINTY_SAMPLES = {'none': 0, 'fast': 100, 'full': 1000}
+
+
+def build_model():
+    # Initialize Prophet model
+    model = Prophet(**model_params)
+    model.add_seasonality(**yearly_seasonality)
+    return model
+
+
+def warm_start_params(model):
+    """The fitted (MAP) parameters of model, as Prophet.fit(init=...) takes them."""
+    params = {name: float(model.params[name][0][0]) for name in ('k', 'm', 'sigma_obs')}
+    params.update({name: model.params[name][0] for name in ('delta', 'beta')})
+    return params
+
+
+def fit_model(item_data, previous=None):
+    """
+    Fit a new model on item_data. Given the item's previous model, the optimizer
+    starts from its parameters, which after a few appended days are close to the
+    new optimum. Prophet falls back to its default start for any parameter whose
+    shape no longer matches.
+    """
+    model = build_model()
+    if previous is None:
+        return model.fit(item_data)
+    return model.fit(item_data, init=warm_start_params(previous))
+
+
+def model_key(data_name, product_id, data_version):
+    return ModelCache.make_key(data_name, product_id, data_version,
+                               {**model_params, 'seasonality': yearly_seasonality})
+
+
+def window_dates(last_date, periods):
+    """The `periods` daily dates following last_date, like Prophet's make_future_dataframe without history."""
+    return pd.date_range(pd.Timestamp(last_date) + pd.Timedelta(days=1), periods=max(periods or 0, 0), freq='D')
+
+
+def forecast_columns(uncertainty):
+    return ['ds', 'yhat'] if uncertainty == 'none' else ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+
+
+def fit_and_predict(model_cache, key, item_data, dates, uncertainty='none', meta=None):
+    """Evaluate the item's model at `dates` only, fitting it first on a cache miss."""
+    model = model_cache.get(key)
+    if model is None:
+        check_cancelled()
+        # Refit after new rows were appended: start from the item's model for its older data
+        previous_version, previous = model_cache.previous(key)
+        start = time.perf_counter()
+        model = fit_model(item_data, previous)
+        model_cache.put(key, model, {
+            **(meta or {}),
+            'warm_started_from': previous_version,
+            'params': {**model_params, 'seasonality': yearly_seasonality},
+            'rows': len(item_data),
+            'fit_ms': round((time.perf_counter() - start) * 1000, 1),
+            'fitted_at': datetime.now().isoformat(timespec='seconds'),
+        })
+        check_cancelled()  # The model is cached for later requests, only the predict is skipped
+
+    future = pd.DataFrame({'ds': pd.to_datetime(np.asarray(dates))})
+    if future.empty:
+        return future.reindex(columns=forecast_columns(uncertainty)).astype({'ds': 'datetime64[ns]'})
+    future['cap'] = item_data['cap'].iloc[0]  # Use the same cap from historical data
+    future['floor'] = 0  # Prevent negative values
+
+    # Cached models are shared between requests, so the sample count is set on a shallow copy
+    model = copy.copy(model)
+    model.uncertainty_samples = UNCERTAINTY_SAMPLES[uncertainty]
+    forecast = model.predict(future)
+    return forecast[forecast_columns(uncertainty)]
+
+
+# ----- Worker process side -----
+_worker_cache = None
+
+
+def init_worker(cache_dir, max_models, warm_keys=()):
+    global _worker_cache
+    # Pay for the Prophet import and the Stan model load once per worker, not per fit
+    build_model()
+    _worker_cache = ModelCache(cache_dir, max_models=max_models)
+    if warm_keys:
+        logging.info(f"Worker loaded {_worker_cache.warm(warm_keys)} of {len(warm_keys)} warm models")
+
+
+def forecast_task(task):
+    item_data = read_frame(task['item_data'])
+    dates = read_frame(task['dates'])['ds']
+    forecast = fit_and_predict(_worker_cache, task['key'], item_data, dates, task['uncertainty'], task['meta'])
+    shm, descriptor = share_frame(forecast)
+    shm.close()  # The parent unlinks the block once it has read it
+    return descriptor
+
+
+class ForecastEngine:
+    """
+    Runs fit/predict either in the calling thread ('thread') or in a pool of warm
+    worker processes ('process'). In process mode every worker keeps its own
+    in-memory model cache on top of the shared on-disk one.
+
+    A forecast requested under a cancel token stops when the token is cancelled:
+    between fit and predict in thread mode, by killing the worker in process mode.
+    Fits that still ran to the end for a cancelled token are counted as wasted.
+    Process mode queues fits at the priority of the calling thread. Given
+    worker_bounds (min, max), it starts with `workers` processes and lets a
+    ConcurrencyController resize the pool within the bounds from the measured fits.
+    """
+
+    def __init__(self, mode, workers, cache_dir, max_models, worker_bounds=None):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown engine mode: {mode}")
+        self.mode = mode
+        self.worker_bounds = worker_bounds
+        self.workers = min(max(workers, worker_bounds[0]), worker_bounds[1]) if worker_bounds else workers
+        self.controller = None
+        self.cache_dir = cache_dir
+        self.max_models = max_models
+        self.model_cache = ModelCache(cache_dir, max_models=max_models) if mode == 'thread' else None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.counters = {'cancelled': 0, 'wasted': 0}
+        self._counter_lock = threading.Lock()
+
+    def start(self, warm_keys=()):
+        """Start the workers, each with the models of warm_keys already in memory."""
+        if self.mode == 'thread':
+            if warm_keys:
+                logging.info(f"Loaded {self.model_cache.warm(list(warm_keys))} of {len(warm_keys)} warm models")
+        elif self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = WorkerPool(forecast_task, self.workers, initializer=init_worker,
+                                            initargs=(self.cache_dir, self.max_models, list(warm_keys)),
+                                            name='forecast')
+                    if self.worker_bounds:
+                        self.controller = ConcurrencyController(self._pool, *self.worker_bounds).start()
+        return self
+
+    @property
+    def max_workers(self):
+        """The most fits that may run at once, to size the threads feeding the engine."""
+        if self.mode == 'process' and self.worker_bounds:
+            return self.worker_bounds[1]
+        return self.workers
+
+    def forecast(self, key, item_data, dates, uncertainty='none', meta=None):
+        token = current_token()
+        try:
+            forecast = self._forecast(token, key, item_data, dates, uncertainty, meta)
+        except Cancelled:
+            self._count('cancelled')
+            raise
+        if token is not None and token.cancelled:
+            self._count('wasted')
+        return forecast
+
+    def _forecast(self, token, key, item_data, dates, uncertainty, meta):
+        if self.mode == 'thread':
+            return fit_and_predict(self.model_cache, key, item_data, dates, uncertainty, meta)
+
+        self.start()
+        data_shm, data_descriptor = share_frame(item_data[['ds', 'y', 'cap', 'floor']])
+        dates_shm, dates_descriptor = share_frame(pd.DataFrame({'ds': pd.to_datetime(np.asarray(dates))}))
+        try:
+            future = self._pool.submit({'key': key, 'item_data': data_descriptor, 'dates': dates_descriptor,
+                                        'uncertainty': uncertainty, 'meta': meta}, current_priority())
+            unregister = token.on_cancel(lambda: self._pool.cancel(future)) if token is not None else None
+            try:
+                result = future.result()
+            except CancelledError:  # Dropped from the queue before a worker took it
+                raise Cancelled()
+            finally:
+                if unregister is not None:
+                    unregister()
+        finally:
+            release(data_shm)
+            release(dates_shm)
+        return read_frame(result, unlink=True)
+
+    def stats(self):
+        with self._counter_lock:
+            fits = dict(self.counters)
+        if self.mode == 'thread':
+            return {'mode': 'thread', 'model_cache': self.model_cache.stats(), 'fits': fits}
+        return {'mode': 'process', 'pool': self._pool.stats() if self._pool else None, 'fits': fits,
+                'concurrency': self.controller.stats() if self.controller else None}
+
+    def _count(self, name):
+        with self._counter_lock:
+            self.counters[name] += 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            logging.info("Forecast pool stopped")
@@ -0,0 +1,61 @@
+"""
+Append new rows to the price or sales dataset. The CSV needs the dataset's Date,
+Item Code and value columns (Wholesale Price (RMB/kg) or Quantity Sold (kilo),
+or just 'value'); other columns are ignored. By default the rows are posted to
+the running predictor, which makes them visible at once. With --offline they
+only go to the append log, which the predictor replays at its next start. Run
+from the price_predictor directory:
+
+    python ingest.py price new_prices.csv
+    python ingest.py sales new_sales.csv --url http://localhost:5002
+    python ingest.py price new_prices.csv --offline
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
+
+
+def post_rows(url, dataset, path):
+    with open(path, 'rb') as f:
+        body = f.read()
+    req = urllib.request.Request(f'{url}/ingest/{dataset}', data=body, method='POST',
+                                 headers={'Content-Type': 'text/csv'})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        sys.exit(f"Ingestion failed ({e.code}): {e.read().decode()}")
+
+
+def append_offline(dataset, path):
+    import price_predictor as pp
+
+    start = time.perf_counter()
+    rows = pd.read_csv(path, dtype={'Item Code': str})
+    item_codes = pp.data_store.append(pp.ingest_datasets[dataset], rows)
+    return {'dataset': dataset, 'rows': len(rows), 'items': len(item_codes),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataset', choices=['price', 'sales'])
+    parser.add_argument('csv_path')
+    parser.add_argument('--url', default='http://localhost:5002', help='predictor server to post the rows to')
+    parser.add_argument('--offline', action='store_true', help='append to the log without a running server')
+    args = parser.parse_args()
+
+    if args.offline:
+        result = append_offline(args.dataset, args.csv_path)
+    else:
+        result = post_rows(args.url, args.dataset, args.csv_path)
+    print(json.dumps(result, indent=1))
+
+
+if __name__ == '__main__':
+    main()
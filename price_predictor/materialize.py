@@ -0,0 +1,108 @@
+"""
+Fit every item of the price and sales datasets and write their forecasts for the
+next `--horizon` days to the materialized forecast tables. The predictor answers
+requests whose dates fall inside that window from the tables, without fitting.
+Run from the price_predictor directory:
+
+    python materialize.py --horizon 365
+    python materialize.py --horizon 365 --every 6    # rebuild every 6 hours
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import price_predictor as pp
+from forecast_table import ForecastTable
+from forecasting import window_dates
+
+
+def fit_item(prediction_type, product_id, horizon, engine_name, uncertainty):
+    data_name = pp.prediction_datasets[prediction_type]
+    version = pp.data_store.item_version(data_name, product_id)
+    _, item_data = pp.prediction_preparers[prediction_type](product_id)
+
+    start = time.perf_counter()
+    dates = window_dates(item_data['ds'].max(), horizon)
+    forecast = pp.fit_forecast(data_name, product_id, item_data, dates, engine_name, uncertainty)
+    return version, forecast, (time.perf_counter() - start) * 1000
+
+
+def materialize(prediction_type, horizon, engine_name, uncertainty, items=None):
+    data_name = pp.prediction_datasets[prediction_type]
+    product_ids = pp.data_store.item_codes(data_name)[:items]
+
+    start = time.perf_counter()
+    forecasts = []
+    failed = 0
+    # One thread per engine worker keeps them all busy without fits queueing behind each other
+    with ThreadPoolExecutor(max_workers=max(pp.engine.max_workers, 1)) as pool:
+        futures = {pool.submit(fit_item, prediction_type, product_id, horizon, engine_name, uncertainty): product_id
+                   for product_id in product_ids}
+        for future in as_completed(futures):
+            product_id = futures[future]
+            try:
+                version, forecast, fit_ms = future.result()
+            except Exception as e:
+                failed += 1
+                logging.warning(f"Could not forecast {data_name} item {product_id}: {e}")
+                continue
+            forecasts.append((product_id, version, forecast, fit_ms))
+
+    # Keep the table in item order so rebuilds of unchanged data produce the same file
+    forecasts.sort(key=lambda entry: entry[0])
+    table = ForecastTable.from_forecasts(forecasts, {
+        'engine': engine_name,
+        'uncertainty': uncertainty,
+        'horizon': horizon,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'runtime_s': round(time.perf_counter() - start, 3),
+        'failed': failed,
+    })
+    pp.forecast_tables.save(data_name, table)
+    return table
+
+
+def run(args):
+    for prediction_type in args.datasets:
+        try:
+            table = materialize(prediction_type, args.horizon, args.engine, args.uncertainty, args.items)
+        except FileNotFoundError as e:
+            logging.warning(f"Skipping {prediction_type}, dataset not available: {e.filename}")
+            continue
+        summary = table.summary()
+        print(f"{prediction_type}: {summary['items']} items ({summary['failed']} failed), {summary['rows']} rows "
+              f"in {summary['runtime_s']:.1f} s, fit median {summary['fit_ms_median'] or 0:.0f} ms, "
+              f"p95 {summary['fit_ms_p95'] or 0:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', nargs='+', choices=list(pp.prediction_datasets),
+                        default=list(pp.prediction_datasets))
+    parser.add_argument('--horizon', type=int, default=365, help='days forecast past each item history')
+    parser.add_argument('--engine', choices=pp.FORECAST_ENGINES, default=pp.FORECAST_ENGINE)
+    parser.add_argument('--uncertainty', choices=pp.UNCERTAINTY_MODES, default=pp.UNCERTAINTY_MODE)
+    parser.add_argument('--items', type=int, default=None, help='only materialize the first N items')
+    parser.add_argument('--every', type=float, default=None, help='rebuild every N hours instead of once')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    # Prophet/cmdstanpy log every fit
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    logging.getLogger('prophet').setLevel(logging.ERROR)
+
+    pp.data_store.preload()
+    try:
+        while True:
+            run(args)
+            if args.every is None:
+                break
+            time.sleep(args.every * 3600)
+    finally:
+        pp.engine.shutdown()
+
+
+if __name__ == '__main__':
+    main()
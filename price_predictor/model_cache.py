@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from prophet.serialize import model_from_json, model_to_json
+
+# Bumped whenever the artifact layout changes; artifacts of other versions stay in their own directory, unused
+ARTIFACT_VERSION = 1
+
+
+def _write_atomic(path, text):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def params_digest(params):
+    """Short stable digest of a JSON-serializable hyperparameter dict."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class ModelCache:
+    """
+    Fitted Prophet models, most recently used first, backed by an on-disk artifact store.
+
+    Entries are keyed by (dataset, item code, data version, hyperparameter digest),
+    so a model is never served for data it was not fitted on. Models evicted from
+    memory are reloaded from their JSON file on the next request. Next to every
+    model a .meta.json file records what it was fitted on and how long it took;
+    write_manifest() collects them into manifest.json. Only pretrain.py writes
+    the manifest, so models the server fits afterwards have their .meta.json
+    but are missing from it until the next pretrain run.
+    """
+
+    def __init__(self, cache_dir, max_models=64):
+        self.cache_dir = cache_dir
+        self.artifact_dir = os.path.join(cache_dir, f'v{ARTIFACT_VERSION}')
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(self.artifact_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data_name, item_code, data_version, params):
+        return data_name, str(item_code), data_version, params_digest(params)
+
+    def _path(self, key, suffix='.json'):
+        return os.path.join(self.artifact_dir, '-'.join(key) + suffix)
+
+    def get(self, key):
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                model = model_from_json(f.read())
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable model {path}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, model)
+        return model
+
+    def previous(self, key):
+        """
+        (data version, model) of the model stored for key's item and hyperparameters
+        but fitted on other data, or (None, None).
+        """
+        with self._lock:
+            for other in reversed(self._models):
+                if other[:2] == key[:2] and other[3] == key[3] and other != key:
+                    return other[2], self._models[other]
+
+        prefix, suffix = f'{key[0]}-{key[1]}-', f'-{key[3]}.json'
+        try:
+            names = os.listdir(self.artifact_dir)
+        except OSError:
+            return None, None
+        for name in names:
+            if name.startswith(prefix) and name.endswith(suffix) and not name.endswith('.meta.json'):
+                data_version = name[len(prefix):-len(suffix)]
+                if data_version == key[2]:
+                    continue
+                try:
+                    with open(os.path.join(self.artifact_dir, name)) as f:
+                        return data_version, model_from_json(f.read())
+                except (OSError, ValueError):
+                    continue
+        return None, None
+
+    def warm(self, keys):
+        """Load the models of keys into memory ahead of their first request; returns how many exist."""
+        return sum(self.get(key) is not None for key in keys[:self.max_models])
+
+    def put(self, key, model, meta=None):
+        with self._lock:
+            self._remember(key, model)
+
+        # Older versions of the same item and hyperparameters can never be hit again
+        self._remove_older_files(key)
+
+        meta = {'dataset': key[0], 'item_code': key[1], 'data_version': key[2], 'params_digest': key[3],
+                **(meta or {})}
+        try:
+            _write_atomic(self._path(key), model_to_json(model))
+            _write_atomic(self._path(key, '.meta.json'), json.dumps(meta, sort_keys=True))
+        except OSError as e:
+            logging.warning(f"Could not persist model {self._path(key)}: {e}")
+
+    def manifest(self):
+        """Metadata of every model in the artifact store."""
+        entries = []
+        for name in sorted(os.listdir(self.artifact_dir)):
+            if name.endswith('.meta.json'):
+                try:
+                    with open(os.path.join(self.artifact_dir, name)) as f:
+                        entries.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # Removed or being replaced by another process
+        return entries
+
+    def write_manifest(self):
+        entries = self.manifest()
+        _write_atomic(os.path.join(self.artifact_dir, 'manifest.json'),
+                    json.dumps({'artifact_version': ARTIFACT_VERSION, 'models': entries}, indent=1))
+        return entries
+
+    def stats(self):
+        with self._lock:
+            return {
+                'models_in_memory': len(self._models),
+                'max_models': self.max_models,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+    def _remember(self, key, model):
+        self._models[key] = model
+        self._models.move_to_end(key)
+        while len(self._models) > self.max_models:
+            self._models.popitem(last=False)
+
+    def _remove_older_files(self, keep):
+        prefix = f'{keep[0]}-{keep[1]}-'
+        keep_stem = '-'.join(keep)
+        try:
+            names = os.listdir(self.artifact_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith(prefix) or name == 'manifest.json':
+                continue
+            stem = name[:-len('.meta.json')] if name.endswith('.meta.json') else name[:-len('.json')]
+            if not name.endswith('.json') or stem == keep_stem:
+                continue
+            if not stem.endswith(f'-{keep[3]}'):
+                continue  # Same item under other hyperparameters
+            try:
+                os.remove(os.path.join(self.artifact_dir, name))
+            except OSError:
+                pass
+
+
+class ModelPopularity:
+    """
+    Request counts per (dataset, item), saved now and then so that a restarted
+    server knows which models to load before its first requests arrive.
+    """
+
+    def __init__(self, path, save_interval=60):
+        self.path = path
+        self.save_interval = save_interval
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._last_save = time.time()
+        try:
+            with open(path) as f:
+                self._counts.update({tuple(key.split('/', 1)): count for key, count in json.load(f).items()})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable request counts {path}: {e}")
+
+    def record(self, data_name, item_code):
+        with self._lock:
+            self._counts[data_name, str(item_code)] += 1
+            due = time.time() - self._last_save > self.save_interval
+        if due:
+            self.save()
+
+    def top(self, n):
+        with self._lock:
+            return [key for key, _ in self._counts.most_common(n)]
+
+    def save(self):
+        with self._lock:
+            self._last_save = time.time()
+            counts = {f'{data_name}/{item_code}': count for (data_name, item_code), count in self._counts.items()}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            _write_atomic(self.path, json.dumps(counts))
+        except OSError as e:
+            logging.warning(f"Could not save request counts {self.path}: {e}")
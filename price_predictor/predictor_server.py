@@ -0,0 +1,28 @@
+"""
+Start the predictor server, or another shard of it on its own port. Run from
+the price_predictor directory:
+
+    python predictor_server.py
+    python predictor_server.py --port 5003
+
+The forecast workers are started with multiprocessing's spawn method, which
+imports the main script again in every worker. That is why the server lives in
+price_predictor.py and is imported only inside main(): the workers get this
+script without the Flask app, the data store and the thread pools.
+"""
+import argparse
+
+
+def main():
+    import price_predictor as pp
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=pp.PORT, help='run another instance (shard) on this port')
+    parser.add_argument('--warm-models', type=int, default=pp.WARM_MODELS,
+                        help='load the models of the N most requested items before reporting ready')
+    args = parser.parse_args()
+    pp.run(args.port, args.warm_models)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Fit Prophet models ahead of time and store them in the model artifact store, so
+the predictor only has to load and predict. Fits run on every usable core.
+
+Items whose model is already stored for their current data are skipped. Items
+that got new rows since their model was stored are refitted warm-started from
+it. After a data drop, `--changed` refits just those. Run from the
+price_predictor directory:
+
+    python pretrain.py                                  # every item of both datasets
+    python pretrain.py --datasets price --items 102900005115168 102900005115779
+    python pretrain.py --top 50                         # the 50 most requested items
+    python pretrain.py --changed                        # only items whose history changed
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import price_predictor as pp
+from model_cache import ModelCache
+
+
+def pretrain_item(prediction_type, product_id):
+    data_name = pp.prediction_datasets[prediction_type]
+    _, item_data = pp.prediction_preparers[prediction_type](product_id)
+    start = time.perf_counter()
+    # No dates: fit_and_predict fits and stores the model, then has nothing to predict
+    pp.fit_forecast(data_name, product_id, item_data, [], 'prophet')
+    return (time.perf_counter() - start) * 1000
+
+
+def classify_items(items, artifacts):
+    """Split items into (unchanged, changed, new) by comparing their data version with the stored models."""
+    stored = {}
+    for entry in artifacts.manifest():
+        stored.setdefault((entry['dataset'], entry['item_code']), set()).add(entry['data_version'])
+
+    unchanged, changed, new = [], [], []
+    for prediction_type, product_id in items:
+        data_name = pp.prediction_datasets[prediction_type]
+        versions = stored.get((data_name, product_id))
+        if not versions:
+            new.append((prediction_type, product_id))
+        elif pp.data_store.item_version(data_name, product_id) in versions:
+            unchanged.append((prediction_type, product_id))
+        else:
+            changed.append((prediction_type, product_id))
+    return unchanged, changed, new
+
+
+def select_items(args):
+    if args.top:
+        data_names = {pp.prediction_datasets[prediction_type]: prediction_type for prediction_type in args.datasets}
+        return [(data_names[data_name], product_id) for data_name, product_id in pp.popularity.top(args.top)
+                if data_name in data_names]
+
+    items = []
+    for prediction_type in args.datasets:
+        try:
+            codes = args.items or pp.data_store.item_codes(pp.prediction_datasets[prediction_type])
+        except FileNotFoundError as e:
+            logging.warning(f"Skipping {prediction_type}, dataset not available: {e.filename}")
+            continue
+        items.extend((prediction_type, str(product_id)) for product_id in codes)
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', nargs='+', choices=list(pp.prediction_datasets),
+                        default=list(pp.prediction_datasets))
+    parser.add_argument('--items', nargs='+', default=None, help='item codes to fit (default: all items)')
+    parser.add_argument('--top', type=int, default=None, help='fit the N most requested items instead')
+    parser.add_argument('--changed', action='store_true',
+                        help='only refit items with a stored model for older data')
+    args = parser.parse_args()
+
+    # Prophet/cmdstanpy log every fit
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    logging.getLogger('prophet').setLevel(logging.ERROR)
+
+    artifacts = ModelCache(pp.MODEL_CACHE_DIR)
+    unchanged, changed, new = classify_items(select_items(args), artifacts)
+    items = changed if args.changed else changed + new
+    print(f"{len(unchanged)} items unchanged, {len(changed)} with new rows (warm refit), "
+          f"{len(new)} without a model{' (skipped)' if args.changed else ''}")
+
+    start = time.perf_counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(pp.engine.max_workers, 1)) as pool:
+        futures = {pool.submit(pretrain_item, prediction_type, product_id): (prediction_type, product_id)
+                   for prediction_type, product_id in items}
+        for i, future in enumerate(as_completed(futures), 1):
+            prediction_type, product_id = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{i}/{len(items)}] {prediction_type} {product_id}: failed ({e})")
+                continue
+            print(f"[{i}/{len(items)}] {prediction_type} {product_id}: {elapsed:.0f} ms")
+    pp.engine.shutdown()
+
+    entries = artifacts.write_manifest()
+    print(f"\n{len(items) - failed} models fitted in {time.perf_counter() - start:.1f} s, {failed} failed")
+    print(f"{len(entries)} models in {artifacts.artifact_dir}, manifest written")
+
+
+if __name__ == '__main__':
+    main()
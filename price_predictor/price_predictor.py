@@ -1,31 +1,52 @@
 import logging
+import threading
 
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import io
+import json
 import pandas as pd
-import numpy as np
-from prophet import Prophet
-from concurrent.futures import ThreadPoolExecutor
-from serverutils.threading import get_optimal_worker_count
-import threading
+from concurrent.futures import as_completed
+from serverutils.threading import get_optimal_worker_count, get_optimal_process_count
+from serverutils.admission import PriorityExecutor, AdmissionControl, QueueFull
+from data_store import DataStore
+from forecasting import ForecastEngine, model_key, window_dates, UNCERTAINTY_SAMPLES
+from fast_forecast import fast_fit_predict
+from forecast_table import ForecastTables
+from model_cache import ModelPopularity
+from serverutils.cancellation import Cancelled, cancel_scope
+from serverutils.jobs import JobRegistry, FINISHED_STATES
+from serverutils.singleflight import SingleFlight
+from serverutils.result_store import StoredFrame, FORMATS, negotiate_format
+from serverutils.ttl_cache import TTLCache
 import uuid
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 
 app = Flask(__name__)
 CORS(app)
+PORT = 5002
 
-# Time to keep cached images
-CACHE_TIME = 1
+# Time to keep cached images (minutes)
+CACHE_TIME = 10
+CACHE_MAX_ENTRIES = 4096
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 256 * 1024 * 1024))
 
-# Thread-safe cache for storing prediction results
-cache = {}
-cache_lock = threading.Lock()
+# Thread-safe cache for storing prediction results and their graph data
+cache = TTLCache(ttl=CACHE_TIME * 60, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 sizeof=lambda entry: entry['graph_data'].nbytes)
 
 # Thread pool for handling concurrent requests
-executor = ThreadPoolExecutor(max_workers=get_optimal_worker_count())
-logging.info(f"ThreadPoolExecutor initialized with {executor._max_workers} workers")
+executor = PriorityExecutor(max_workers=get_optimal_worker_count())
+logging.info(f"PriorityExecutor initialized with {executor.max_workers} workers")
+
+# Admission control: each prediction type queues at most QUEUE_LIMIT requests, further ones get a 429.
+# Batch items have their own, larger queue and wait behind the interactive requests.
+QUEUE_LIMIT = int(os.environ.get('QUEUE_LIMIT', 64))
+BATCH_QUEUE_LIMIT = int(os.environ.get('BATCH_QUEUE_LIMIT', 1024))
+admission = AdmissionControl(executor,
+                             limits={'price': QUEUE_LIMIT, 'demand': QUEUE_LIMIT, 'batch': BATCH_QUEUE_LIMIT},
+                             priorities={'price': 0, 'demand': 0, 'batch': 1})
 
 # Data file and column mappings
 data_file_mapping = {
@@ -39,28 +60,83 @@ data_column_names = {
 }
 
 
-def load_data(data_name='super_market_prices'):
-    file_path = data_file_mapping[data_name]
-    data = pd.read_csv(file_path)
-    data = data.rename(columns=data_column_names[data_name])
-    data['ds'] = pd.to_datetime(data['ds'])
-    data['Item Code'] = data['Item Code'].astype('string')
-    return data
+# Transaction logs, streamed in bounded chunks and kept as daily per-item totals
+daily_total_datasets = ('super_market_sales',)
 
+# Datasets are parsed once and shared by all worker threads; ingested rows are logged in INGEST_LOG_DIR
+INGEST_LOG_DIR = './data/ingested'
+data_store = DataStore(data_file_mapping, data_column_names, log_dir=INGEST_LOG_DIR,
+                       daily_totals=daily_total_datasets)
 
-def run_price_predictor(product_id, time_period, optional_date):
-    data = load_data('super_market_prices')
+# Prophet fits run in warm worker processes, one per usable core ('thread' runs them in-process)
+PREDICTOR_ENGINE = os.environ.get('PREDICTOR_ENGINE', 'process')
+MODEL_CACHE_DIR = './models'
+MODEL_CACHE_SIZE = int(os.environ.get('MODEL_CACHE_SIZE', 64))
+# The pool starts at the estimated count, then resizes itself within these bounds from what the fits cost
+MIN_FIT_WORKERS = int(os.environ.get('MIN_FIT_WORKERS', 1))
+MAX_FIT_WORKERS = int(os.environ.get('MAX_FIT_WORKERS', 2 * (os.cpu_count() or 1)))
+engine = ForecastEngine(PREDICTOR_ENGINE, get_optimal_process_count(), MODEL_CACHE_DIR, MODEL_CACHE_SIZE,
+                        worker_bounds=(MIN_FIT_WORKERS, MAX_FIT_WORKERS))
 
-    if time_period:
-        time_period = int(time_period)
+# Models of the most requested items, loaded into every worker at startup (--warm-models)
+WARM_MODELS = int(os.environ.get('WARM_MODELS', 32))
+popularity = ModelPopularity(os.path.join(MODEL_CACHE_DIR, 'popularity.json'))
+server_ready = threading.Event()
+
+# Forecasting model: 'prophet', or 'fast' for the closed-form NumPy model. Requests may pick their own.
+FORECAST_ENGINES = ('prophet', 'fast')
+FORECAST_ENGINE = os.environ.get('FORECAST_ENGINE', 'prophet')
+
+# Forecast interval: 'none' skips sampling, 'fast' draws 100 samples, 'full' Prophet's 1000
+UNCERTAINTY_MODES = tuple(UNCERTAINTY_SAMPLES)
+UNCERTAINTY_MODE = os.environ.get('UNCERTAINTY_MODE', 'fast')
+
+# Graph data column of each forecast column
+graph_columns = {'ds': 'Date', 'yhat': 'Price', 'yhat_lower': 'Lower', 'yhat_upper': 'Upper'}
+
+# Forecasts precomputed by materialize.py, served whenever they cover the requested dates
+MATERIALIZED_DIR = './materialized'
+forecast_tables = ForecastTables(MATERIALIZED_DIR)
+
+
+def fit_forecast(data_name, product_id, item_data, dates, engine_name=None, uncertainty='none'):
+    """Forecast the item at `dates` only; the history itself is never re-predicted."""
+    if (engine_name or FORECAST_ENGINE) == 'fast':
+        return fast_fit_predict(item_data, dates, uncertainty)
+
+    key = model_key(data_name, product_id, data_store.item_version(data_name, product_id))
+    return engine.forecast(key, item_data, dates, uncertainty, {'dataset_checksum': data_store.version(data_name)})
 
-    item_data = data[data['Item Code'] == product_id]
+
+def run_forecast(data_name, product_id, item_data, dates, engine_name=None, uncertainty='none'):
+    engine_name = engine_name or FORECAST_ENGINE
+    popularity.record(data_name, product_id)
+    forecast = forecast_tables.lookup(data_name, product_id, data_store.item_version(data_name, product_id),
+                                      dates, engine_name, uncertainty)
+    if forecast is not None:
+        return forecast
+    return fit_forecast(data_name, product_id, item_data, dates, engine_name, uncertainty)
+
+
+def forecast_dates(item_data, time_period, optional_date):
+    """The forecast window shown in the graph, plus optional_date when it lies inside the history."""
+    last_date = item_data['ds'].max()
+    if optional_date:
+        optional_date = pd.to_datetime(optional_date)
+        time_period = (optional_date - last_date).days
+    dates = window_dates(last_date, time_period)
+    if optional_date and optional_date <= last_date:
+        dates = dates.append(pd.DatetimeIndex([optional_date]))
+    return dates
+
+
+def prepare_price_data(product_id):
+    item_data = data_store.get_item('super_market_prices', product_id)
 
     his_data = item_data[['ds','y']].copy()
     his_data.columns = ["Date","Price"]
     his_data['Type'] = 'Historical'
 
-    item_data.loc[:, 'ds'] = np.array(item_data['ds'])
     item_data['cap'] = item_data['y'].max() * 2.5 # # Set a cap 250% higher than the max observed demand
     item_data['floor'] = 0 # Assuming demand can't go negative
 
@@ -68,30 +144,21 @@ def run_price_predictor(product_id, time_period, optional_date):
     item_data = item_data[item_data['y'] >= item_data['y'].quantile(0.02)]  # Remove bottom 2% outliers
     item_data = item_data[item_data['y'] <= item_data['y'].quantile(0.98)]  # Remove top 2% outliers
 
-    # Initialize Prophet model
-    model = Prophet(growth='logistic', 
-                changepoint_prior_scale=0.05,  # Lower values make the model less sensitive to trend changes
-                seasonality_prior_scale= 15 ,
-                yearly_seasonality=True,       # Enable yearly seasonality by default
-                weekly_seasonality=False,      # Disable weekly seasonality if irrelevant
-                daily_seasonality=False)       # Disable daily seasonality if irrelevant
-    model.add_seasonality(name='yearly', period=365.25, fourier_order=12)
+    return his_data, item_data
 
-    model.fit(item_data)
 
-    if optional_date:
-        time_period = pd.to_datetime(optional_date) - item_data['ds'].max()
-        time_period = time_period.days
+def run_price_predictor(product_id, time_period, optional_date, engine_name=None, uncertainty=None):
+    if time_period:
+        time_period = int(time_period)
 
-    future = model.make_future_dataframe(periods=time_period)
-    future['cap'] = item_data['cap'].iloc[0]  # Use the same cap from historical data
-    future['floor'] = 0  # Prevent negative value
+    his_data, item_data = prepare_price_data(product_id)
 
-    forecast = model.predict(future)
+    dates = forecast_dates(item_data, time_period, optional_date)
+    forecast = run_forecast('super_market_prices', product_id, item_data, dates, engine_name,
+                            uncertainty or UNCERTAINTY_MODE)
 
 
-    cast_data = forecast[['ds','yhat']].copy()
-    cast_data.columns = ["Date","Price"]
+    cast_data = forecast.rename(columns=graph_columns)
     cast_data['Type'] = 'Forecast'
     cast_data = cast_data[cast_data['Date'] > his_data.max()["Date"]]
     graph_data = pd.concat([his_data, cast_data], ignore_index=True)
@@ -102,21 +169,14 @@ def run_price_predictor(product_id, time_period, optional_date):
 
     return predicted_price, graph_data
 
-def run_demand_predictor(product_id, time_period, optional_date):
-    data = load_data('super_market_sales')
-
-    if time_period:
-        time_period = int(time_period)
-
-    item_data = data[data['Item Code'] == product_id]
+def prepare_demand_data(product_id):
+    # Daily totals of the transaction log, plus any transactions ingested since
+    item_data = data_store.get_item('super_market_sales', product_id)
 
     # Handling Negative Quantities
     item_data = item_data[item_data['y'] >= 0]
 
-    # Ensure the 'ds' column is a numpy array
-    item_data.loc[:, 'ds'] = np.array(item_data['ds'])
-
-    # Aggregate demands on the same days
+    # Aggregate demands on the same days (only ingested transactions still need it)
     item_data = item_data.groupby('ds', as_index=False)['y'].sum()
 
     #copy data for the graph display
@@ -132,31 +192,21 @@ def run_demand_predictor(product_id, time_period, optional_date):
     item_data = item_data[item_data['y'] >= item_data['y'].quantile(0.02)]  # Remove bottom 2% outliers
     item_data = item_data[item_data['y'] <= item_data['y'].quantile(0.98)]  # Remove top 2% outliers
 
+    return his_data, item_data
 
 
-    # Initialize Prophet model
-    model = Prophet(growth='logistic', 
-                changepoint_prior_scale=0.05,  # Lower values make the model less sensitive to trend changes
-                seasonality_prior_scale= 15 ,
-                yearly_seasonality=True,       # Enable yearly seasonality by default
-                weekly_seasonality=False,      # Disable weekly seasonality if irrelevant
-                daily_seasonality=False)       # Disable daily seasonality if irrelevant
-    model.add_seasonality(name='yearly', period=365.25, fourier_order=12)
+def run_demand_predictor(product_id, time_period, optional_date, engine_name=None, uncertainty=None):
+    if time_period:
+        time_period = int(time_period)
 
-    model.fit(item_data)
+    his_data, item_data = prepare_demand_data(product_id)
 
-    if optional_date:
-        time_period = pd.to_datetime(optional_date) - item_data['ds'].max()
-        time_period = time_period.days
+    dates = forecast_dates(item_data, time_period, optional_date)
+    forecast = run_forecast('super_market_sales', product_id, item_data, dates, engine_name,
+                            uncertainty or UNCERTAINTY_MODE)
 
-    future = model.make_future_dataframe(periods=time_period)
-    future['cap'] = item_data['cap'].iloc[0]  # Use the same cap from historical data
-    future['floor'] = 0  # Prevent negative values
-    forecast = model.predict(future)
 
-
-    cast_data = forecast[['ds','yhat']].copy()
-    cast_data.columns = ["Date","Price"]
+    cast_data = forecast.rename(columns=graph_columns)
     cast_data['Type'] = 'Forecast'
     cast_data = cast_data[cast_data['Date'] > his_data.max()["Date"]]
     graph_data = pd.concat([his_data, cast_data], ignore_index=True)
@@ -167,104 +217,501 @@ def run_demand_predictor(product_id, time_period, optional_date):
 
     return predicted_demand, graph_data
 
-def cache_prediction(product_id, time_period, optional_date, prediction_type):
+def run_predictor(prediction_type, product_id, time_period, optional_date, engine_name=None, uncertainty=None):
     if prediction_type == 'price':
-        predicted_value, graph_data = run_price_predictor(product_id, time_period, optional_date)
+        return run_price_predictor(product_id, time_period, optional_date, engine_name, uncertainty)
     elif prediction_type == 'demand':
-        predicted_value, graph_data = run_demand_predictor(product_id, time_period, optional_date)
+        return run_demand_predictor(product_id, time_period, optional_date, engine_name, uncertainty)
     else:
         raise ValueError("Invalid prediction type")
 
-    # Generate a unique ID for this prediction
-    prediction_id = str(uuid.uuid4())
 
-    # save data_graph
-    data_path = f'temp_{prediction_id}.csv'
-    graph_data.to_csv(data_path, index=False)
+# Identical predictions requested concurrently share one computation
+in_flight = SingleFlight()
+
+
+def run_predictor_once(prediction_type, product_id, time_period, optional_date, engine_name=None,
+                       uncertainty=None):
+    key = ('forecast', prediction_type, product_id, time_period, optional_date, engine_name, uncertainty)
+    return in_flight.do(key, run_predictor, prediction_type, product_id, time_period, optional_date, engine_name,
+                        uncertainty)
+
+
+def compute_prediction(prediction_type, product_id, time_period, optional_date, engine_name=None,
+                       uncertainty=None):
+    predicted_value, graph_data = run_predictor_once(prediction_type, product_id, time_period, optional_date,
+                                                     engine_name, uncertainty)
+    return predicted_value, StoredFrame(graph_data)
+
+
+def cache_prediction(product_id, time_period, optional_date, prediction_type, job=None, engine_name=None,
+                     uncertainty=None):
+    if job is not None:
+        job.update(state='running', stage='forecasting', progress=10)
+
+    # Coalesced requests also share the stored graph data
+    key = ('graph', prediction_type, product_id, time_period, optional_date, engine_name, uncertainty)
+    predicted_value, graph_data = in_flight.do(key, compute_prediction, prediction_type, product_id,
+                                               time_period, optional_date, engine_name, uncertainty)
+
+    # Generate a unique ID for this prediction
+    prediction_id = job.prediction_id if job is not None else str(uuid.uuid4())
 
     # Store the result in the cache
-    with cache_lock:
-        cache[prediction_id] = {
-            'product_id': product_id,
-            'predicted_value': predicted_value,
-            'data_path': data_path,
-            'timestamp': datetime.now(),
-            'prediction_type': prediction_type
-        }
+    cache.set(prediction_id, {
+        'product_id': product_id,
+        'predicted_value': predicted_value,
+        'graph_data': graph_data,
+        'timestamp': datetime.now(),
+        'prediction_type': prediction_type
+    })
 
-    return prediction_id
+    return prediction_id, predicted_value
 
 
-@app.route('/predict_price', methods=['POST'])
-def predict_price():
-    data = request.json
-    product_id = str(data['product_id'])
-    time_period = data['time_period']
-    optional_date = data.get('optional_date')
+# Name of the predicted value in responses, per prediction type
+prediction_value_names = {'price': 'predicted_price', 'demand': 'predicted_demand'}
 
-    # Run the prediction in a separate thread
-    future = executor.submit(cache_prediction, product_id, time_period, optional_date, 'price')
-    prediction_id = future.result()
+# Submitted predictions, so clients can poll them instead of holding a request open
+jobs = JobRegistry(max_age=CACHE_TIME * 60)
 
+
+def run_job(job):
+    if job.finished:  # Cancelled while it waited for a thread
+        return
+    params = job.params
+    try:
+        # Cancelling the job stops its fit, unless other requests are waiting for the same one
+        with cancel_scope(job.token):
+            _, predicted_value = cache_prediction(params['product_id'], params['time_period'],
+                                                  params['optional_date'], job.prediction_type, job,
+                                                  params['engine'], params['uncertainty'])
+    except Cancelled:
+        logging.info(f"Prediction {job.prediction_id} cancelled")
+        return
+    except Exception as e:
+        logging.exception(f"Prediction {job.prediction_id} failed")
+        job.update(state='failed', stage='failed', error=str(e))
+        return
+
+    job.update(state='done', stage='done', progress=100,
+               result={prediction_value_names[job.prediction_type]: predicted_value})
+
+
+def get_engine_name(data):
+    engine_name = data.get('engine') or FORECAST_ENGINE
+    if engine_name not in FORECAST_ENGINES:
+        raise ValueError(f"Invalid engine, use one of {', '.join(FORECAST_ENGINES)}")
+    return engine_name
+
+
+def get_uncertainty_mode(data):
+    uncertainty = data.get('uncertainty') or UNCERTAINTY_MODE
+    if uncertainty not in UNCERTAINTY_MODES:
+        raise ValueError(f"Invalid uncertainty mode, use one of {', '.join(UNCERTAINTY_MODES)}")
+    return uncertainty
+
+
+def submit_prediction(prediction_type, data):
+    if prediction_type not in prediction_value_names:
+        raise ValueError("Invalid prediction type")
+
+    job = jobs.create(prediction_type, {
+        'product_id': str(data['product_id']),
+        'time_period': data.get('time_period'),
+        'optional_date': data.get('optional_date'),
+        'engine': get_engine_name(data),
+        'uncertainty': get_uncertainty_mode(data),
+    })
+    try:
+        admission.submit(prediction_type, run_job, job)
+    except QueueFull:
+        jobs.discard(job.prediction_id)
+        raise
+    return job
+
+
+def queue_full_response(e):
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+
+def predict_sync(prediction_type):
+    # Thin wrapper over the job API for clients that expect the result in the response
+    try:
+        job = submit_prediction(prediction_type, request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return queue_full_response(e)
+    status = job.wait()
+    if job.state == 'failed':
+        return jsonify({'prediction_id': job.prediction_id, 'error': job.error}), 500
+    if job.state == 'cancelled':
+        return jsonify({'prediction_id': job.prediction_id, 'error': 'Prediction was cancelled'}), 410
+
+    value_name = prediction_value_names[prediction_type]
     response = {
-        'prediction_id': prediction_id,
-        'product_id': product_id,
-        'predicted_price': cache[prediction_id]['predicted_value']
+        'prediction_id': job.prediction_id,
+        'product_id': status.get('product_id'),
+        value_name: status.get(value_name)
     }
 
     return jsonify(response)
 
+
+@app.route('/predict_price', methods=['POST'])
+def predict_price():
+    return predict_sync('price')
+
 @app.route('/predict_demand', methods=['POST'])
 def predict_demand():
-    data = request.json
-    product_id = str(data['product_id'])
-    time_period = data['time_period']
-    optional_date = data.get('optional_date')
+    return predict_sync('demand')
 
-    # Run the prediction in a separate thread
-    future = executor.submit(cache_prediction, product_id, time_period, optional_date, 'demand')
-    prediction_id = future.result()
+@app.route('/predictions', methods=['POST'])
+def create_prediction():
+    data = request.json
+    try:
+        job = submit_prediction(data.get('prediction_type'), data)
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f"Invalid prediction request: {e}"}), 400
+    except QueueFull as e:
+        return queue_full_response(e)
+
+    return jsonify(job.to_dict()), 202
+
+@app.route('/predictions/<prediction_id>', methods=['GET'])
+def prediction_status(prediction_id):
+    job = jobs.get(prediction_id)
+    if job is None:
+        return jsonify({'error': 'Prediction not found'}), 404
+
+    # Long-poll: ?wait=<seconds>[&version=<last seen version>]
+    wait = request.args.get('wait', type=float)
+    if wait:
+        return jsonify(job.wait(timeout=min(wait, 60), version=request.args.get('version', type=int)))
+    return jsonify(job.to_dict())
+
+@app.route('/predictions/<prediction_id>', methods=['DELETE'])
+def cancel_prediction(prediction_id):
+    job = jobs.cancel(prediction_id)
+    if job is None:
+        return jsonify({'error': 'Prediction not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/predictions/<prediction_id>/events', methods=['GET'])
+def prediction_events(prediction_id):
+    job = jobs.get(prediction_id)
+    if job is None:
+        return jsonify({'error': 'Prediction not found'}), 404
+
+    def generate():
+        version = -1
+        while True:
+            status = job.wait(timeout=15, version=version)
+            if status['version'] == version:
+                yield ": keep-alive\n\n"  # Stop proxies from closing an idle stream
+                continue
+            version = status['version']
+            yield f"data: {json.dumps(status)}\n\n"
+            if status['state'] in FINISHED_STATES:
+                return
+
+    return Response(generate(), mimetype='text/event-stream')
+
+# Datasets holding the item codes of each prediction type
+prediction_datasets = {'price': 'super_market_prices', 'demand': 'super_market_sales'}
+prediction_preparers = {'price': prepare_price_data, 'demand': prepare_demand_data}
+
+# Upper bound on the dates of one point query
+MAX_POINT_DATES = 1000
+
+
+def run_point_predictor(prediction_type, product_id, dates, engine_name=None):
+    """Evaluate the model at the given dates only, skipping the graph data entirely."""
+    _, item_data = prediction_preparers[prediction_type](product_id)
+    forecast = run_forecast(prediction_datasets[prediction_type], product_id, item_data, dates, engine_name)
+    return {ds.strftime('%Y-%m-%d'): float(yhat) for ds, yhat in zip(forecast['ds'], forecast['yhat'])}
+
+
+@app.route('/predict_points', methods=['POST'])
+def predict_points():
+    data = request.json
+    prediction_type = data.get('prediction_type', 'price')
+    if prediction_type not in prediction_datasets:
+        return jsonify({'error': 'Invalid prediction type'}), 400
+    try:
+        engine_name = get_engine_name(data)
+        product_id = str(data['product_id'])
+        dates = data['dates']
+        dates = pd.DatetimeIndex(pd.to_datetime([dates] if isinstance(dates, str) else dates))
+        dates = dates.normalize().unique().sort_values()
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid point query: {e}"}), 400
+    if len(dates) > MAX_POINT_DATES:
+        return jsonify({'error': f"At most {MAX_POINT_DATES} dates per query"}), 400
+
+    key = ('points', prediction_type, product_id, tuple(dates.asi8), engine_name)
+    try:
+        values = admission.submit(prediction_type, in_flight.do, key, run_point_predictor, prediction_type,
+                                  product_id, dates, engine_name).result()
+    except QueueFull as e:
+        return queue_full_response(e)
+    except FileNotFoundError as e:
+        return jsonify({'error': f"Dataset not available: {e.filename}"}), 404
+    except Exception as e:
+        logging.exception(f"Point query for {product_id} failed")
+        return jsonify({'error': str(e)}), 500
 
-    response = {
-        'prediction_id': prediction_id,
+    return jsonify({
         'product_id': product_id,
-        'predicted_demand': cache[prediction_id]['predicted_value']
-    }
+        'prediction_type': prediction_type,
+        prediction_value_names[prediction_type]: values,
+    })
+
+
+def store_batch_result(frames, tasks):
+    # Registered as a finished job so /predictions/<id> finds it, which is how the web server locates its shard
+    job = jobs.create('batch', {})
+    job.update(state='done', stage='done', progress=100)
+    prediction_id = job.prediction_id
+    if frames:
+        combined = pd.concat(frames, ignore_index=True)
+    else:
+        combined = pd.DataFrame(columns=['Item Code', 'Prediction', 'Date', 'Value'])
+
+    cache.set(prediction_id, {
+        'product_id': None,
+        'predicted_value': None,
+        'graph_data': StoredFrame(combined),
+        'timestamp': datetime.now(),
+        'prediction_type': 'batch',
+        # (prediction_type, product_id) of every item in the batch, so new data for any of them drops it
+        'items': frozenset(tasks)
+    })
+    return prediction_id, len(combined)
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Forecast many items at once. Streams one JSON line per finished item and a
+    final line with the prediction_id of the combined forecast table.
+    """
+    data = request.json
+    prediction_types = data.get('prediction_types') or [data.get('prediction_type', 'price')]
+    product_ids = data.get('product_ids', 'all')
+    time_period = data.get('time_period')
+    optional_date = data.get('optional_date')
 
-    return jsonify(response)
+    if any(prediction_type not in prediction_datasets for prediction_type in prediction_types):
+        return jsonify({'error': 'Invalid prediction type'}), 400
+    if not (time_period or optional_date):
+        return jsonify({'error': 'time_period or optional_date is required'}), 400
+    if product_ids != 'all' and not isinstance(product_ids, list):
+        return jsonify({'error': "product_ids must be a list of item codes or 'all'"}), 400
+    try:
+        engine_name = get_engine_name(data)
+        uncertainty = get_uncertainty_mode(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    tasks = []
+    try:
+        for prediction_type in prediction_types:
+            if product_ids == 'all':
+                items = data_store.item_codes(prediction_datasets[prediction_type])
+            else:
+                items = [str(product_id) for product_id in product_ids]
+            tasks.extend((prediction_type, product_id) for product_id in items)
+    except FileNotFoundError as e:
+        return jsonify({'error': f"Dataset not available: {e.filename}"}), 404
+
+    # Each task ends up on the forecast engine, which spreads the fits over all cores.
+    # The batch is admitted whole or not at all.
+    try:
+        submitted = admission.submit_all('batch', run_predictor_once, [
+            (prediction_type, product_id, time_period, optional_date, engine_name, uncertainty)
+            for prediction_type, product_id in tasks])
+    except QueueFull as e:
+        return queue_full_response(e)
+    futures = dict(zip(submitted, tasks))
+
+    def generate():
+        frames = []
+        failed = 0
+        for future in as_completed(futures):
+            prediction_type, product_id = futures[future]
+            line = {'product_id': product_id, 'prediction_type': prediction_type}
+            try:
+                predicted_value, graph_data = future.result()
+            except Exception as e:
+                failed += 1
+                line['error'] = str(e)
+                yield f"{json.dumps(line)}\n"
+                continue
+
+            forecast = graph_data[graph_data['Type'] == 'Forecast']
+            frame = pd.DataFrame({
+                'Item Code': product_id,
+                'Prediction': prediction_type,
+                'Date': forecast['Date'].to_numpy(),
+                'Value': forecast['Price'].to_numpy(),
+            })
+            if 'Lower' in forecast:
+                frame['Lower'] = forecast['Lower'].to_numpy()
+                frame['Upper'] = forecast['Upper'].to_numpy()
+            frames.append(frame)
+            line[prediction_value_names[prediction_type]] = predicted_value
+            line['forecast_rows'] = len(forecast)
+            yield f"{json.dumps(line)}\n"
+
+        prediction_id, rows = store_batch_result(frames, tasks)
+        yield f"{json.dumps({'prediction_id': prediction_id, 'items': len(tasks), 'failed': failed, 'rows': rows})}\n"
+
+    return Response(generate(), mimetype='application/json')
+
+# Datasets that accept new rows, by the name used in /ingest/<dataset>
+ingest_datasets = {'price': 'super_market_prices', 'sales': 'super_market_sales'}
+
+
+def invalidate_items(data_name, item_codes):
+    """Drop the stored predictions of items whose data changed; returns how many were dropped."""
+    prediction_types = {prediction_type for prediction_type, name in prediction_datasets.items() if name == data_name}
+    item_codes = set(item_codes)
+    # Models and materialized forecasts are keyed by the item's data version, new rows make them miss on their own
+    changed = {(prediction_type, item_code) for prediction_type in prediction_types for item_code in item_codes}
+
+    def stale(prediction_id, entry):
+        if entry['prediction_type'] == 'batch':
+            return not changed.isdisjoint(entry['items'])
+        return (entry['prediction_type'], entry['product_id']) in changed
+    return cache.remove_if(stale)
+
+
+@app.route('/ingest/<dataset>', methods=['POST'])
+def ingest(dataset):
+    """
+    Append rows to a dataset: a CSV body (text/csv) with the dataset's Date, Item
+    Code and value columns, or JSON {"rows": [{"Date": ..., "Item Code": ..., "value": ...}]}.
+    """
+    data_name = ingest_datasets.get(dataset)
+    if data_name is None:
+        return jsonify({'error': f"Unknown dataset, use one of {', '.join(ingest_datasets)}"}), 404
+
+    start = datetime.now()
+    try:
+        if request.mimetype == 'text/csv':
+            rows = pd.read_csv(io.BytesIO(request.get_data()), dtype={'Item Code': str})
+        else:
+            body = request.json
+            rows = pd.DataFrame(body['rows'] if isinstance(body, dict) else body)
+        item_codes = data_store.append(data_name, rows)
+    except FileNotFoundError as e:
+        return jsonify({'error': f"Dataset not available: {e.filename}"}), 404
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid rows: {e}"}), 400
+
+    invalidated = invalidate_items(data_name, item_codes)
+    return jsonify({
+        'dataset': dataset,
+        'rows': len(rows),
+        'items': len(item_codes),
+        'invalidated_predictions': invalidated,
+        'elapsed_ms': round((datetime.now() - start).total_seconds() * 1000, 1),
+    })
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'engine': engine.stats(),
+        'single_flight': in_flight.stats(),
+        'jobs': jobs.stats(),
+        'admission': admission.stats(),
+        'cache': cache.stats(),
+        'materialized': forecast_tables.stats(),
+        'ingested_rows': {dataset: data_store.appended_rows(data_name) for dataset, data_name in ingest_datasets.items()},
+    })
+
+# Endpoints that run forecasts. Until warm_up has started the engine with the popular models they answer
+# 503, since the first forecast would start the worker pool without them.
+forecast_endpoints = {'predict_price', 'predict_demand', 'create_prediction', 'predict_points', 'predict_batch'}
+# Seconds a client is told to wait while the server warms up
+WARM_UP_RETRY_AFTER = 5
+
+@app.before_request
+def require_ready():
+    if request.endpoint in forecast_endpoints and not server_ready.is_set():
+        response = jsonify({'error': 'The predictor is starting up', 'retry_after': WARM_UP_RETRY_AFTER})
+        response.headers['Retry-After'] = str(WARM_UP_RETRY_AFTER)
+        return response, 503
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # 503 until the datasets are parsed and the popular models are loaded
+    status = {'ready': server_ready.is_set(), 'engine': PREDICTOR_ENGINE}
+    return jsonify(status), 200 if server_ready.is_set() else 503
 
 @app.route('/get_data/<prediction_id>', methods=['GET'])
 def get_data(prediction_id):
-    with cache_lock:
-        if prediction_id not in cache:
-            return "Data not found", 404
-        data_path = cache[prediction_id]['data_path']
+    job = jobs.get(prediction_id)
+    if job is not None and not job.finished:
+        return jsonify(job.to_dict()), 202
+    if job is not None and job.state == 'failed':
+        return jsonify(job.to_dict()), 500
+    if job is not None and job.state == 'cancelled':
+        return jsonify(job.to_dict()), 410
+
+    entry = cache.get(prediction_id)
+    if entry is None:
+        return "Data not found", 404
+    graph_data = entry['graph_data']
+
+    # ?format=csv|csv.gz|json|arrow, or the matching Accept header; CSV by default
+    fmt = negotiate_format(request.args.get('format'), request.accept_mimetypes)
+    if fmt is None:
+        return jsonify({'error': 'Unsupported format', 'formats': list(FORMATS)}), 406
+
+    etag = f'{graph_data.etag}-{fmt}'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
 
-    return send_file(data_path, mimetype='text/csv')
-
-def delete_file_if_exists(file_path):
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"Deleted file: {file_path}")
-    except Exception as e:
-        print(f"Error deleting file {file_path}: {str(e)}")
-
-def clean_cache():
-    with cache_lock:
-        current_time = datetime.now()
-        for prediction_id in list(cache.keys()):
-            if current_time - cache[prediction_id]['timestamp'] > timedelta(minutes=CACHE_TIME):
-                data_path = cache[prediction_id]['data_path']
-                delete_file_if_exists(data_path)
-                del cache[prediction_id]
-                print(f"Removed cache entry and data for prediction_id: {prediction_id}")
-
-# Run cache cleaning every 5 minutes
-def cache_cleaning_job():
-    clean_cache()
-    threading.Timer(300, cache_cleaning_job).start()
-
-if __name__ == '__main__':
-    cache_cleaning_job()  # Start the cache cleaning job
-    app.run(host='0.0.0.0', port=5002, debug=True, threaded=True)
\ No newline at end of file
+        body = graph_data.serialize(fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 406
+
+    response = Response(body, mimetype=FORMATS[fmt])
+    response.set_etag(etag)
+    return response
+
+def warm_keys(count):
+    """Model keys of the `count` most requested items, for their current data."""
+    keys = []
+    for data_name, product_id in popularity.top(count):
+        try:
+            keys.append(model_key(data_name, product_id, data_store.item_version(data_name, product_id)))
+        except (FileNotFoundError, KeyError):
+            continue
+    return keys
+
+
+def warm_up(warm_models):
+    data_store.preload()  # Parse the datasets before serving the first request
+    keys = warm_keys(min(warm_models, MODEL_CACHE_SIZE))
+    engine.start(keys)  # Start the worker processes with the popular models in memory
+    server_ready.set()
+    logging.info(f"Predictor ready, {len(keys)} popular models warmed")
+
+
+def run(port=PORT, warm_models=WARM_MODELS):
+    """Serve on port, warming up in the background. Started by predictor_server.py."""
+    global popularity
+    if port != PORT:
+        # Each shard counts the requests for its own items, so it warms those at startup
+        popularity = ModelPopularity(os.path.join(MODEL_CACHE_DIR, f'popularity-{port}.json'))
+
+    threading.Thread(target=warm_up, args=(warm_models,), name='warm-up', daemon=True).start()
+    # The reloader would run this twice and start a second set of worker processes
+    app.run(host='0.0.0.0', port=port, debug=True, threaded=True, use_reloader=False)
@@ -0,0 +1,166 @@
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+# The priority of the call running in each thread, so the fits it starts queue with the same priority
+_scope = threading.local()
+
+
+def current_priority():
+    return getattr(_scope, 'priority', 0)
+
+
+@contextmanager
+def priority_scope(priority):
+    previous = current_priority()
+    _scope.priority = priority
+    try:
+        yield priority
+    finally:
+        _scope.priority = previous
+
+
+class PriorityExecutor:
+    """
+    A fixed thread pool that runs the queued call with the lowest priority
+    number first, and calls of equal priority in submission order.
+    """
+
+    def __init__(self, max_workers, name='executor'):
+        self.max_workers = max_workers
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = [threading.Thread(target=self._work, name=f'{name}-{i}', daemon=True)
+                         for i in range(max_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, *args, priority=0, **kwargs):
+        future = Future()
+        self._queue.put((priority, next(self._sequence), future, fn, args, kwargs))
+        return future
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put((math.inf, next(self._sequence), None, None, (), {}))
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            priority, _, future, fn, args, kwargs = self._queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with priority_scope(priority):
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+class QueueFull(Exception):
+    """The lane's queue is full. retry_after: seconds until it has likely drained enough."""
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"Too many queued {lane} requests, retry in {retry_after} s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class _Lane:
+    def __init__(self, limit, priority):
+        self.limit = limit
+        self.priority = priority
+        self.queued = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=1000)  # Queue wait (s) of the latest calls to start
+        self.service = None              # Moving average of the run time (s)
+
+
+class AdmissionControl:
+    """
+    Bounded queues in front of a PriorityExecutor. Each lane admits at most
+    `limit` waiting calls and runs them at its priority; submitting beyond the
+    limit raises QueueFull instead of queueing without bound.
+    """
+
+    def __init__(self, executor, limits, priorities):
+        self.executor = executor
+        self.lanes = {name: _Lane(limit, priorities.get(name, 0)) for name, limit in limits.items()}
+        self._lock = threading.Lock()
+
+    def submit(self, lane_name, fn, *args):
+        return self.submit_all(lane_name, fn, [args])[0]
+
+    def submit_all(self, lane_name, fn, calls):
+        """Queue fn(*args) for every args in calls, all or none."""
+        lane = self.lanes[lane_name]
+        with self._lock:
+            if lane.queued + len(calls) > lane.limit:
+                lane.rejected += 1
+                raise QueueFull(lane_name, self._retry_after(lane, len(calls)))
+            lane.queued += len(calls)
+            lane.admitted += len(calls)
+
+        futures = []
+        for args in calls:
+            future = self.executor.submit(self._run, lane, time.monotonic(), fn, args, priority=lane.priority)
+            future.add_done_callback(lambda f: f.cancelled() and self._dequeue(lane))
+            futures.append(future)
+        return futures
+
+    def _run(self, lane, submitted_at, fn, args):
+        started = time.monotonic()
+        with self._lock:
+            lane.queued -= 1
+            lane.running += 1
+            lane.waits.append(started - submitted_at)
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                lane.running -= 1
+                lane.service = elapsed if lane.service is None else 0.8 * lane.service + 0.2 * elapsed
+
+    def _dequeue(self, lane):
+        with self._lock:
+            lane.queued -= 1
+
+    def _retry_after(self, lane, calls):
+        # Time for enough of the queue to drain at the recent run time, spread over the threads
+        excess = lane.queued + calls - lane.limit
+        service = lane.service if lane.service is not None else 1.0
+        return max(1, math.ceil(excess * service / max(self.executor.max_workers, 1)))
+
+    def stats(self):
+        with self._lock:
+            lanes = {}
+            for name, lane in self.lanes.items():
+                waits = np.array(lane.waits) * 1000
+                lanes[name] = {
+                    'limit': lane.limit,
+                    'priority': lane.priority,
+                    'queued': lane.queued,
+                    'running': lane.running,
+                    'admitted': lane.admitted,
+                    'rejected': lane.rejected,
+                    'wait_ms_p50': float(np.percentile(waits, 50)) if len(waits) else None,
+                    'wait_ms_p95': float(np.percentile(waits, 95)) if len(waits) else None,
+                    'wait_ms_max': float(waits.max()) if len(waits) else None,
+                    'service_ms': lane.service * 1000 if lane.service is not None else None,
+                }
+            return lanes
@@ -0,0 +1,87 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+
+class Cancelled(Exception):
+    """Raised instead of the result of work whose requesters have all gone away."""
+
+
+class CancelToken:
+    """A one-shot cancellation signal. Callbacks run once, in the thread that cancels."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Cancellation callback failed")
+        return True
+
+    def on_cancel(self, callback):
+        """Run callback on cancellation (now, if already cancelled). Returns a function that unregisters it."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+# The token of the work running in each thread, so deep calls can stop without passing it around
+_scope = threading.local()
+
+
+def current_token():
+    return getattr(_scope, 'token', None)
+
+
+@contextmanager
+def cancel_scope(token):
+    previous = current_token()
+    _scope.token = token
+    try:
+        yield token
+    finally:
+        _scope.token = previous
+
+
+def check_cancelled():
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def wait_result(future, token=None):
+    """future.result(), unless token is cancelled first; then raise Cancelled and leave the future be."""
+    if token is None:
+        return future.result()
+    settled = threading.Event()
+    future.add_done_callback(lambda _: settled.set())
+    unregister = token.on_cancel(settled.set)
+    try:
+        settled.wait()
+    finally:
+        unregister()
+    if not future.done():
+        raise Cancelled()
+    return future.result()
@@ -0,0 +1,162 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import psutil
+
+
+class ConcurrencyController:
+    """
+    Resizes a WorkerPool between min_workers and max_workers from what its
+    tasks actually cost. Every `interval` seconds it looks at the tasks that
+    finished since the last look:
+
+    - memory: the p95 peak RSS of a worker during a task says how many more
+      workers fit in the available RAM, keeping `reserve` of the total free.
+      Any swapping shrinks the pool at once.
+    - CPU: CPU seconds per second of a task say how many tasks the usable
+      cores run side by side.
+    - demand: the pool grows one worker at a time while tasks wait in the
+      queue, and shrinks when fewer workers than it has are busy on average.
+    - throughput: a step up that did not raise the tasks finished per second
+      is undone, and the size it reached is avoided for `hold_steps` looks.
+    """
+
+    def __init__(self, pool, min_workers, max_workers, interval=10, reserve=0.1, hold_steps=30):
+        self.pool = pool
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.reserve = reserve
+        self.hold_steps = hold_steps
+        try:
+            self.cores = len(psutil.Process().cpu_affinity())
+        except (AttributeError, psutil.Error):  # Not available on macOS
+            self.cores = psutil.cpu_count()
+
+        self.measurements = {}
+        self.decisions = deque(maxlen=50)  # Recent resizes, newest last
+        self.last_decision = None
+        self._last_step = time.monotonic()
+        self._swapped_out = psutil.swap_memory().sout
+        self._grown_from = None  # (workers, throughput) before the last step up
+        self._ceiling = None     # (workers, steps left) a step up found no faster
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='concurrency-controller', daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.step()
+            except Exception:
+                logging.exception("Concurrency controller step failed")
+
+    def measure(self):
+        now = time.monotonic()
+        samples = np.array(self.pool.samples_since(self._last_step)).reshape(-1, 5)
+        elapsed = now - self._last_step
+        self._last_step = now
+        _, waits, runs, cpus, peaks = samples.T
+        memory = psutil.virtual_memory()
+        swapped_out = psutil.swap_memory().sout
+        pool = self.pool.stats()
+
+        def percentile(values, q):
+            return float(np.percentile(values, q)) if len(values) else None
+
+        measurements = {
+            'window_s': round(elapsed, 1),
+            'tasks': len(samples),
+            'throughput_per_s': len(samples) / elapsed,
+            # Average number of workers busy over the window
+            'concurrency': float(runs.sum()) / elapsed,
+            'queued': pool['queued'],
+            'wait_s_p50': percentile(waits, 50),
+            'wait_s_p95': percentile(waits, 95),
+            'run_s_p50': percentile(runs, 50),
+            'run_s_p95': percentile(runs, 95),
+            'cpu_s_mean': float(cpus.mean()) if len(samples) else None,
+            # CPU seconds per second of a task; below 1 the task waits on I/O or its Stan child
+            'cpu_per_run_s': float(cpus.sum() / runs.sum()) if runs.sum() > 0 else None,
+            'peak_rss_mb_p95': percentile(peaks, 95) / 2 ** 20 if len(samples) else None,
+            'available_mb': memory.available / 2 ** 20,
+            'total_mb': memory.total / 2 ** 20,
+            'swapped_out_mb': (swapped_out - self._swapped_out) / 2 ** 20,
+            'cores': self.cores,
+        }
+        self._swapped_out = swapped_out
+        self.measurements = measurements
+        return measurements
+
+    def limits(self, m, workers):
+        """Upper bounds on the worker count, by what imposes them."""
+        limits = {'max': self.max_workers}
+        if m['peak_rss_mb_p95']:
+            spare_mb = m['available_mb'] - self.reserve * m['total_mb']
+            limits['memory'] = workers + math.floor(spare_mb / m['peak_rss_mb_p95'])
+        if m['cpu_per_run_s'] is not None:
+            limits['cpu'] = max(1, math.floor(self.cores / min(max(m['cpu_per_run_s'], 0.1), 1.0)))
+        if self._ceiling is not None:
+            limits['no_gain'] = self._ceiling[0] - 1
+        return limits
+
+    def decide(self, m, workers):
+        limits = self.limits(m, workers)
+        target = max(min(limits.values()), self.min_workers)
+
+        if m['swapped_out_mb'] > 0 or limits.get('memory', workers) < workers:
+            return max(self.min_workers, min(limits.get('memory', workers), workers - 1)), 'memory', limits
+        if workers > target:
+            return target, 'over limit', limits
+        if self._grown_from is not None and m['queued'] > 0:
+            previous_workers, previous_throughput = self._grown_from
+            if m['throughput_per_s'] <= previous_throughput * 1.05:
+                self._ceiling = (workers, self.hold_steps)
+                return previous_workers, 'no throughput gain', limits
+        if m['queued'] > 0 and workers < target:
+            return workers + 1, 'backlog', limits
+        if m['queued'] == 0 and workers > self.min_workers and m['concurrency'] < workers - 1:
+            return workers - 1, 'idle', limits
+        return workers, 'hold', limits
+
+    def step(self):
+        m = self.measure()
+        workers = self.pool.target_workers
+        new_workers, reason, limits = self.decide(m, workers)
+
+        self._grown_from = (workers, m['throughput_per_s']) if new_workers > workers else None
+        if self._ceiling is not None:
+            ceiling, steps = self._ceiling
+            self._ceiling = (ceiling, steps - 1) if steps > 1 else None
+
+        decision = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'workers': workers,
+            'new_workers': new_workers,
+            'reason': reason,
+            'limits': limits,
+        }
+        self.last_decision = decision
+        if new_workers != workers:
+            self.decisions.append(decision)
+            logging.info(f"Resizing the worker pool from {workers} to {new_workers}: {reason}")
+            self.pool.resize(new_workers)
+        return decision
+
+    def stats(self):
+        return {
+            'bounds': [self.min_workers, self.max_workers],
+            'interval_s': self.interval,
+            'last_decision': self.last_decision,
+            'measurements': self.measurements,
+            'resizes': list(self.decisions),
+        }
@@ -0,0 +1,140 @@
+import threading
+import time
+import uuid
+
+from serverutils.cancellation import CancelToken
+
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+class Job:
+    """State of one submitted prediction, observable while it runs."""
+
+    def __init__(self, prediction_type, params):
+        self.prediction_id = str(uuid.uuid4())
+        self.prediction_type = prediction_type
+        self.params = params
+        self.state = 'pending'
+        self.stage = 'queued'
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        # Bumped on every update so pollers can wait for "anything newer than what I saw"
+        self.version = 0
+        self._changed = threading.Condition()
+        # The job's work runs under this token, cancel() fires it
+        self.token = CancelToken()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def update(self, state=None, stage=None, progress=None, result=None, error=None):
+        with self._changed:
+            if self.state == 'cancelled':  # Work still winding down must not revive the job
+                return
+            if state is not None:
+                self.state = state
+                if state in FINISHED_STATES:
+                    self.finished_at = time.time()
+            if stage is not None:
+                self.stage = stage
+            if progress is not None:
+                self.progress = progress
+            if result is not None:
+                self.result = result
+            if error is not None:
+                self.error = error
+            self.version += 1
+            self._changed.notify_all()
+
+    def cancel(self):
+        """Cancel the job unless it has finished. Returns whether it was cancelled."""
+        with self._changed:
+            if self.finished:
+                return False
+            self.update(state='cancelled', stage='cancelled')
+        self.token.cancel()
+        return True
+
+    def wait(self, timeout=None, version=None):
+        """Block until the job changes past `version` (or finishes, if no version is given)."""
+        with self._changed:
+            if version is None:
+                self._changed.wait_for(lambda: self.finished, timeout)
+            else:
+                self._changed.wait_for(lambda: self.version > version or self.finished, timeout)
+            return self.to_dict()
+
+    def to_dict(self):
+        status = {
+            'prediction_id': self.prediction_id,
+            'prediction_type': self.prediction_type,
+            'product_id': self.params.get('product_id'),
+            'state': self.state,
+            'stage': self.stage,
+            'progress': self.progress,
+            'version': self.version,
+            'submitted_at': self.submitted_at,
+            'finished_at': self.finished_at,
+        }
+        if self.result is not None:
+            status.update(self.result)
+        if self.error is not None:
+            status['error'] = self.error
+        return status
+
+
+class JobRegistry:
+    """Jobs by prediction id. Finished jobs are forgotten max_age seconds after they finish."""
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+        self.cancelled = 0
+
+    def create(self, prediction_type, params):
+        job = Job(prediction_type, params)
+        with self._lock:
+            self._jobs[job.prediction_id] = job
+        # Amortize the sweep over submissions instead of running a timer
+        if time.time() - self._last_prune > min(self.max_age, 60):
+            self.prune()
+        return job
+
+    def get(self, prediction_id):
+        with self._lock:
+            return self._jobs.get(prediction_id)
+
+    def discard(self, prediction_id):
+        with self._lock:
+            self._jobs.pop(prediction_id, None)
+
+    def cancel(self, prediction_id):
+        """The job, cancelled if it was still running, or None if there is no such job."""
+        job = self.get(prediction_id)
+        if job is not None and job.cancel():
+            with self._lock:
+                self.cancelled += 1
+        return job
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {'cancelled_total': self.cancelled, **states}
+
+    def prune(self):
+        self._last_prune = time.time()
+        cutoff = self._last_prune - self.max_age
+        with self._lock:
+            expired = [prediction_id for prediction_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for prediction_id in expired:
+                del self._jobs[prediction_id]
+        return expired
@@ -0,0 +1,346 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import psutil
+
+from serverutils.cancellation import Cancelled
+
+_STOP = None
+
+# Seconds between memory samples of a worker while it runs a task
+SAMPLE_INTERVAL = 0.05
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+def _kill_process_tree(pid):
+    """Kill a process and everything it started (a fit runs Stan in a child process)."""
+    try:
+        parent = psutil.Process(pid)
+        processes = parent.children(recursive=True) + [parent]
+    except psutil.NoSuchProcess:
+        return
+    for process in processes:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+    psutil.wait_procs(processes, timeout=5)
+
+
+def _tree_rss(process):
+    """Resident memory of a process plus its children, 0 once it is gone."""
+    try:
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    rss = 0
+    for child in processes:
+        try:
+            rss += child.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return rss
+
+
+def _cpu_seconds(process):
+    """CPU time of a process and its finished children (Stan runs in one)."""
+    try:
+        times = process.cpu_times()
+    except psutil.NoSuchProcess:
+        return 0.0
+    return times.user + times.system + getattr(times, 'children_user', 0) + getattr(times, 'children_system', 0)
+
+
+def _worker_main(conn, target, initializer, initargs):
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception as e:
+            conn.send(f'{type(e).__name__}: {e}')  # Anything but 'ready' tells the parent why the start failed
+            return
+    conn.send('ready')
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is _STOP:
+            break
+        try:
+            reply = (True, target(task))
+        except Exception as e:
+            reply = (False, e)
+        conn.send(reply)
+
+
+class _Worker:
+    """One long-lived process plus the parent thread that feeds it tasks."""
+
+    def __init__(self, pool, worker_id):
+        self.pool = pool
+        self.worker_id = worker_id
+        self.process = None
+        self.ps = None  # psutil handle of the process, to measure what each task costs
+        self.conn = None
+        self.busy = False
+        self.future = None   # Future of the task being run
+        self.killed = False  # The process was killed to cancel its task and must be replaced
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=f'{pool.name}-{worker_id}', daemon=True)
+
+    def start(self):
+        self._spawn()
+        self.thread.start()
+
+    def _spawn(self):
+        """Start the process and wait for its initializer. Raises WorkerCrashed if it does not come up."""
+        parent_conn, child_conn = self.pool.ctx.Pipe()
+        self.process = self.pool.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.pool.target, self.pool.initializer, self.pool.initargs),
+            name=f'{self.pool.name}-{self.worker_id}',
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        try:
+            self.ps = psutil.Process(self.process.pid)
+            status = self.conn.recv()  # Wait until the worker has run its initializer
+        except (EOFError, OSError, psutil.NoSuchProcess) as e:
+            status = f'{type(e).__name__}: {e}'
+        if status != 'ready':
+            self.process.join(timeout=5)
+            self.conn.close()
+            raise WorkerCrashed(f"Worker process {self.process.name} failed to start: {status}")
+
+    def _respawn(self):
+        """Replace the process. Returns False, with the worker given up, if the new one does not start."""
+        self.process.join(timeout=5)
+        self.conn.close()
+        self.killed = False
+        try:
+            self._spawn()
+        except WorkerCrashed as e:
+            self.pool._lost(self, e)
+            return False
+        return True
+
+    def kill(self, future):
+        """Kill the process if it is running future's task. The worker thread replaces it."""
+        with self._lock:
+            if self.future is not future or self.killed:
+                return False
+            self.killed = True
+            pid = self.process.pid
+        _kill_process_tree(pid)
+        return True
+
+    def _run(self):
+        while True:
+            _, _, future, task, submitted_at = self.pool.tasks.get()
+            if task is _STOP:
+                self.conn.send(_STOP)
+                self.process.join()
+                self.pool._retired(self)
+                return
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self.busy = True
+            with self._lock:
+                self.future = future
+            started = time.monotonic()
+            cpu = _cpu_seconds(self.ps)
+            peak_rss = _tree_rss(self.ps)
+            try:
+                self.conn.send(task)
+                while not self.conn.poll(SAMPLE_INTERVAL):
+                    peak_rss = max(peak_rss, _tree_rss(self.ps))
+                ok, result = self.conn.recv()
+            except (EOFError, OSError) as e:
+                if self.killed:
+                    future.set_exception(Cancelled(f"Task killed with worker process {self.process.name}"))
+                    self.pool._count('killed')
+                else:
+                    logging.error(f"Worker {self.process.name} died: {e}, restarting it")
+                    future.set_exception(WorkerCrashed(f"Worker process {self.process.name} died"))
+                    self.pool._count('crashed')
+                if not self._respawn():
+                    return
+                continue
+            finally:
+                with self._lock:
+                    self.future = None
+                self.busy = False
+
+            self.pool._measure(started - submitted_at, time.monotonic() - started, _cpu_seconds(self.ps) - cpu,
+                               peak_rss)
+
+            # The kill came in just after the reply; the result stands but the process is gone
+            alive = self._respawn() if self.killed else True
+
+            if ok:
+                future.set_result(result)
+                self.pool._count('completed')
+            else:
+                future.set_exception(result)
+                self.pool._count('failed')
+            if not alive:
+                return
+
+
+class WorkerPool:
+    """
+    A fixed set of warm worker processes.
+
+    Each worker runs `initializer(*initargs)` once at start-up and then calls
+    `target(task)` for every task it receives. Tasks and results travel over a
+    pipe, so they should be small descriptors rather than bulk data. A running
+    task is cancelled by killing its worker, which is then started afresh.
+    Queued tasks start lowest priority number first, then in submission order.
+
+    Every task's queue wait, run time, CPU seconds and peak memory of the worker
+    (with its children) are kept in `samples`. resize() changes the number of
+    workers while the pool runs. A worker whose process does not start (its
+    initializer raised, say) is given up; once no worker is left, queued and
+    later tasks fail with WorkerCrashed instead of waiting forever.
+    """
+
+    def __init__(self, target, workers, initializer=None, initargs=(), name='worker'):
+        self.target = target
+        self.initializer = initializer
+        self.initargs = initargs
+        self.name = name
+        # Never fork the threaded server, start the workers from a clean interpreter
+        self.ctx = multiprocessing.get_context('spawn')
+        self.tasks = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'crashed': 0, 'cancelled': 0, 'killed': 0}
+        self._counter_lock = threading.Lock()
+        self.samples = deque(maxlen=1000)  # (finished, queue wait s, run s, cpu s, peak rss bytes) per task
+
+        self._worker_ids = itertools.count()
+        self._workers_lock = threading.Lock()
+        self.workers = []
+        self.target_workers = workers
+        self.error = None  # Why the last worker was lost, while none is running
+        starters = [threading.Thread(target=self._start_worker) for _ in range(workers)]
+        for starter in starters:
+            starter.start()
+        for starter in starters:
+            starter.join()
+        logging.info(f"{name} pool started with {len(self.workers)} of {workers} worker processes")
+
+    def _start_worker(self):
+        worker = _Worker(self, next(self._worker_ids))
+        try:
+            worker.start()
+        except WorkerCrashed as e:
+            self._lost(worker, e)
+            return
+        with self._workers_lock:
+            self.workers.append(worker)
+            self.error = None
+
+    def _lost(self, worker, error):
+        """Give up a worker whose process could not be started. With none left, fail every queued task."""
+        logging.error(str(error))
+        self._count('crashed')
+        with self._workers_lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            if self.workers:
+                return
+            self.error = error
+            while True:
+                try:
+                    _, _, future, task, _ = self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not _STOP and future.set_running_or_notify_cancel():
+                    future.set_exception(WorkerCrashed(f"No {self.name} worker is running: {error}"))
+
+    def _retired(self, worker):
+        with self._workers_lock:
+            self.workers.remove(worker)
+
+    def resize(self, workers):
+        """
+        Start or retire workers until `workers` run. New workers start in the
+        background; a retiring worker first finishes its task.
+        """
+        with self._workers_lock:
+            change = workers - self.target_workers
+            self.target_workers = workers
+        for _ in range(change):
+            threading.Thread(target=self._start_worker, daemon=True).start()
+        for _ in range(-change):
+            # Ahead of every queued task, so the next worker to go idle takes it
+            self.tasks.put((-math.inf, next(self._sequence), None, _STOP, None))
+        if change:
+            logging.info(f"{self.name} pool resized to {workers} worker processes")
+
+    def submit(self, task, priority=0):
+        future = Future()
+        self._count('submitted')
+        with self._workers_lock:
+            if not self.workers and self.error is not None:
+                future.set_exception(WorkerCrashed(f"No {self.name} worker is running: {self.error}"))
+                return future
+            self.tasks.put((priority, next(self._sequence), future, task, time.monotonic()))
+        return future
+
+    def cancel(self, future):
+        """Drop the task if it is still queued, or kill the worker process running it."""
+        if future.cancel():
+            self._count('cancelled')
+            return True
+        with self._workers_lock:
+            workers = list(self.workers)
+        return any(worker.kill(future) for worker in workers)
+
+    def shutdown(self):
+        with self._workers_lock:
+            workers = list(self.workers)
+        for _ in workers:
+            self.tasks.put((math.inf, next(self._sequence), None, _STOP, None))
+        for worker in workers:
+            worker.thread.join()
+
+    def stats(self):
+        with self._counter_lock:
+            counters = dict(self.counters)
+        with self._workers_lock:
+            workers = list(self.workers)
+        return {
+            'workers': len(workers),
+            'target_workers': self.target_workers,
+            'busy_workers': sum(worker.busy for worker in workers),
+            'queued': self.tasks.qsize(),
+            **counters,
+        }
+
+    def samples_since(self, since):
+        with self._counter_lock:
+            return [sample for sample in self.samples if sample[0] > since]
+
+    def _measure(self, wait, run, cpu, peak_rss):
+        with self._counter_lock:
+            self.samples.append((time.monotonic(), wait, run, cpu, peak_rss))
+
+    def _count(self, name):
+        with self._counter_lock:
+            self.counters[name] += 1
@@ -0,0 +1,96 @@
+import gzip
+import hashlib
+import io
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow IPC output is optional
+    pa = None
+
+# Output formats served from stored frames, with their content types
+FORMATS = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'json': 'application/json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+class StoredFrame:
+    """
+    A DataFrame kept as plain NumPy columns. Text columns are dictionary encoded,
+    so a repeated label like 'Historical' costs one byte per row.
+    """
+
+    def __init__(self, frame):
+        self.columns = {}
+        self.categories = {}
+        for name in frame.columns:
+            values = frame[name]
+            if values.dtype.kind in 'biufM':
+                self.columns[name] = values.to_numpy()
+            else:
+                codes, categories = pd.factorize(values)
+                self.columns[name] = codes.astype('int8' if len(categories) < 128 else 'int32')
+                self.categories[name] = list(categories)
+        self.rows = len(frame)
+
+        digest = hashlib.sha1()
+        for name, values in self.columns.items():
+            digest.update(name.encode())
+            digest.update(values.tobytes())
+        self.etag = digest.hexdigest()[:20]
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    def to_frame(self):
+        data = {}
+        for name, values in self.columns.items():
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(values, self.categories[name])
+            else:
+                data[name] = values
+        return pd.DataFrame(data, copy=False)
+
+    def serialize(self, fmt):
+        if fmt == 'csv':
+            return self.to_frame().to_csv(index=False).encode()
+        if fmt == 'csv.gz':
+            return gzip.compress(self.serialize('csv'), compresslevel=5)
+        if fmt == 'json':
+            frame = self.to_frame()
+            columns = {}
+            for name in frame.columns:
+                if frame[name].dtype.kind == 'M':
+                    columns[name] = frame[name].dt.strftime('%Y-%m-%d').tolist()
+                else:
+                    columns[name] = frame[name].astype(object).where(frame[name].notna(), None).tolist()
+            return json.dumps({'rows': self.rows, 'columns': columns}).encode()
+        if fmt == 'arrow':
+            if pa is None:
+                raise ValueError("Arrow output needs pyarrow installed")
+            arrays = {}
+            for name, values in self.columns.items():
+                if name in self.categories:
+                    arrays[name] = pa.DictionaryArray.from_arrays(values, self.categories[name])
+                else:
+                    arrays[name] = pa.array(values)
+            table = pa.table(arrays)
+            sink = io.BytesIO()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue()
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def negotiate_format(requested, accept):
+    """Pick the output format from ?format=, then the Accept header, defaulting to CSV."""
+    if requested:
+        return requested if requested in FORMATS else None
+    best = accept.best_match(list(FORMATS.values()), default='text/csv') if accept else 'text/csv'
+    return next(fmt for fmt, mimetype in FORMATS.items() if mimetype == best)
@@ -0,0 +1,52 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+def share_frame(frame):
+    """
+    Copy the columns of a numeric/datetime DataFrame into one shared memory block.
+
+    Returns the SharedMemory handle and a small descriptor that another process can
+    pass to read_frame. The creator is responsible for unlinking the block unless
+    the reader is asked to do it.
+    """
+    arrays = []
+    columns = []
+    offset = 0
+    for name in frame.columns:
+        values = frame[name].to_numpy()
+        if values.dtype.kind == 'M':
+            values = values.astype('datetime64[ns]')
+        values = np.ascontiguousarray(values)
+        columns.append((name, values.dtype.str, offset))
+        arrays.append(values)
+        offset += -(-values.nbytes // 8) * 8  # Keep every column 8-byte aligned
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (_, _, column_offset), values in zip(columns, arrays):
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=column_offset)[:] = values
+
+    return shm, {'name': shm.name, 'rows': len(frame), 'columns': columns}
+
+
+def read_frame(descriptor, unlink=False):
+    """Rebuild a DataFrame from a share_frame descriptor, copying it out of shared memory."""
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    try:
+        rows = descriptor['rows']
+        data = {
+            name: np.ndarray(rows, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+            for name, dtype, offset in descriptor['columns']
+        }
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return pd.DataFrame(data, copy=False)
+
+
+def release(shm):
+    shm.close()
+    shm.unlink()
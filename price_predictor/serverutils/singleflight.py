@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future
+
+from serverutils.cancellation import CancelToken, cancel_scope, current_token, wait_result
+
+
+class _Flight:
+    def __init__(self):
+        self.future = Future()
+        # Cancelled once every caller has cancelled; the computation runs under it
+        self.token = CancelToken()
+        self.callers = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a call for
+    their key is in flight wait for it and share its result (or exception).
+
+    A caller running under a cancel token stops waiting when it is cancelled. The
+    call itself is cancelled only when all of its callers are.
+
+    Keys are tuples whose first element names the kind of call, which is used to
+    keep separate counters per kind.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        caller = current_token()
+        with self._lock:
+            counters = self._counters.setdefault(key[0], {'executed': 0, 'coalesced': 0})
+            flight = self._calls.get(key)
+            # A call everyone has abandoned is on its way out, start afresh
+            leader = flight is None or flight.token.cancelled
+            if leader:
+                flight = _Flight()
+                self._calls[key] = flight
+                counters['executed'] += 1
+            else:
+                counters['coalesced'] += 1
+            flight.callers += 1
+        leave = caller.on_cancel(lambda: self._leave(flight)) if caller is not None else None
+
+        try:
+            if not leader:
+                return wait_result(flight.future, caller)
+
+            try:
+                with cancel_scope(flight.token):
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                flight.future.set_exception(e)
+                raise
+            else:
+                flight.future.set_result(result)
+                return result
+        finally:
+            if leave is not None:
+                leave()
+            if leader:
+                with self._lock:
+                    if self._calls.get(key) is flight:
+                        del self._calls[key]
+
+    def _leave(self, flight):
+        with self._lock:
+            flight.callers -= 1
+            abandoned = flight.callers == 0
+        if abandoned:
+            flight.token.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                # Every coalesced call is a computation that did not have to run
+                'saved': sum(counters['coalesced'] for counters in self._counters.values()),
+                **{kind: dict(counters) for kind, counters in self._counters.items()},
+            }
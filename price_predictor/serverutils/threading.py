@@ -19,4 +19,23 @@ def get_optimal_worker_count():
     optimal_workers = min(cpu_based_workers, memory_based_workers)
 
     # Ensure we have at least 2 workers and no more than 32
-    return max(2, min(optimal_workers, 32))
\ No newline at end of file
+    return max(2, min(optimal_workers, 32))
+
+
+def get_optimal_process_count():
+    # Prophet fits are CPU bound and hold the GIL between Stan calls, so threads do not
+    # add throughput beyond the first one. Run one worker process per usable core instead.
+    try:
+        usable_cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on Windows/macOS
+        usable_cores = os.cpu_count()
+
+    # Hyper-threads share a core's execution units; one Stan optimization saturates a core
+    physical_cores = psutil.cpu_count(logical=False) or usable_cores
+    cpu_based_workers = min(usable_cores, physical_cores)
+
+    # A warm worker holds pandas, Prophet and a few cached models
+    estimated_memory_per_worker = 400 * 1024 * 1024  # 400 MB
+    memory_based_workers = psutil.virtual_memory().available // estimated_memory_per_worker
+
+    return max(1, min(cpu_based_workers, memory_based_workers))
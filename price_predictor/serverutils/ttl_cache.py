@@ -0,0 +1,130 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, nbytes, expires_at, seq), least recently used first
+        self.expiry = []              # heap of (expires_at, seq, key), may hold stale items
+        self.nbytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+
+class TTLCache:
+    """
+    Thread-safe cache with a per-entry time to live and entry/byte caps.
+
+    Keys are spread over independently locked shards so concurrent requests rarely
+    contend. Each shard evicts expired entries from a heap ordered by expiry time
+    (O(log n) per entry, no background timer) and, when over its share of the caps,
+    the least recently used entries.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes, shards=16, sizeof=None):
+        self.ttl = ttl
+        self.shards = [_Shard() for _ in range(shards)]
+        self.max_entries_per_shard = max(1, max_entries // shards)
+        self.max_bytes_per_shard = max(1, max_bytes // shards)
+        self.sizeof = sizeof or (lambda value: 0)
+        self._seq = itertools.count()
+
+    def _shard(self, key):
+        return self.shards[hash(key) % len(self.shards)]
+
+    def get(self, key, default=None):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None and entry[2] <= now:
+                self._remove(shard, key)
+                shard.counters['expired'] += 1
+                entry = None
+            if entry is None:
+                shard.counters['misses'] += 1
+                return default
+            shard.entries.move_to_end(key)
+            shard.counters['hits'] += 1
+        return entry[0]
+
+    def __contains__(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            return entry is not None and entry[2] > time.monotonic()
+
+    def set(self, key, value, ttl=None):
+        nbytes = self.sizeof(value)
+        shard = self._shard(key)
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        seq = next(self._seq)
+        with shard.lock:
+            if key in shard.entries:
+                self._remove(shard, key)
+            shard.entries[key] = (value, nbytes, expires_at, seq)
+            shard.nbytes += nbytes
+            heapq.heappush(shard.expiry, (expires_at, seq, key))
+
+            self._expire(shard, now)
+            while len(shard.entries) > 1 and (len(shard.entries) > self.max_entries_per_shard or
+                                              shard.nbytes > self.max_bytes_per_shard):
+                self._remove(shard, next(iter(shard.entries)))
+                shard.counters['evicted'] += 1
+
+    def remove_if(self, predicate):
+        """Remove every entry whose (key, value) matches predicate; returns how many were removed."""
+        removed = 0
+        for shard in self.shards:
+            with shard.lock:
+                for key in [key for key, entry in shard.entries.items() if predicate(key, entry[0])]:
+                    self._remove(shard, key)
+                    removed += 1
+        return removed
+
+    def stats(self):
+        entries = 0
+        nbytes = 0
+        counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+        for shard in self.shards:
+            with shard.lock:
+                entries += len(shard.entries)
+                nbytes += shard.nbytes
+                for name, value in shard.counters.items():
+                    counters[name] += value
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'entries': entries,
+            'bytes': nbytes,
+            'max_entries': self.max_entries_per_shard * len(self.shards),
+            'max_bytes': self.max_bytes_per_shard * len(self.shards),
+            'ttl': self.ttl,
+            'hit_rate': counters['hits'] / lookups if lookups else None,
+            **counters,
+        }
+
+    @staticmethod
+    def _remove(shard, key):
+        value, nbytes, expires_at, seq = shard.entries.pop(key)
+        shard.nbytes -= nbytes
+        # The heap item is left behind and skipped once it reaches the top
+
+    def _expire(self, shard, now):
+        expired = 0
+        while shard.expiry and shard.expiry[0][0] <= now:
+            expires_at, seq, key = heapq.heappop(shard.expiry)
+            entry = shard.entries.get(key)
+            if entry is not None and entry[3] == seq:
+                self._remove(shard, key)
+                expired += 1
+        shard.counters['expired'] += expired
+
+        # Stale heap items of overwritten or evicted entries; rebuild once they dominate
+        if len(shard.expiry) > 2 * len(shard.entries) + 64:
+            shard.expiry = [(entry[2], entry[3], key) for key, entry in shard.entries.items()]
+            heapq.heapify(shard.expiry)
+        return expired
@@ -14,7 +14,7 @@ cd ..
 echo "Starting Price Predictor..."
 cd ./price_predictor/
 source .venv/bin/activate
-nohup python price_predictor.py &
+nohup python predictor_server.py &
 deactivate
 
 echo "ML Servers have been started!"
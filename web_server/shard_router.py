@@ -0,0 +1,97 @@
+import bisect
+import hashlib
+import threading
+import time
+
+import requests
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ShardRouter:
+    """
+    Maps item codes to predictor instances on a consistent-hash ring. Every
+    shard owns `replicas` points on the ring and an item belongs to the first
+    shard clockwise from the item's hash, so an item's models and cached
+    results stay on one shard, and adding or losing a shard only moves the
+    items next to its points.
+
+    A background thread calls every shard's /ready each `interval` seconds.
+    Shards that do not answer (or fail a request) are skipped, which hands
+    their items to the next shard on the ring until they answer again.
+    """
+
+    def __init__(self, urls, replicas=100, interval=5, timeout=2):
+        self.urls = list(urls)
+        self.interval = interval
+        self.timeout = timeout
+        ring = sorted((_hash(f'{url}#{i}'), url) for url in self.urls for i in range(replicas))
+        self._points = [point for point, _ in ring]
+        self._owners = [url for _, url in ring]
+        self.healthy = {url: True for url in self.urls}
+        self.ready = {url: None for url in self.urls}
+        self.routed = {url: 0 for url in self.urls}
+        self.last_check = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._loop, name='shard-health', daemon=True).start()
+        return self
+
+    def _loop(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        for url in self.urls:
+            try:
+                response = requests.get(f'{url}/ready', timeout=self.timeout)
+                # 503 is a shard still warming up: it answers, so it keeps its items
+                healthy, ready = response.status_code in (200, 503), response.status_code == 200
+            except requests.RequestException:
+                healthy, ready = False, False
+            self._set_health(url, healthy)
+            self.ready[url] = ready
+        self.last_check = time.time()
+
+    def mark_down(self, url):
+        """Skip the shard until its next successful health check."""
+        self._set_health(url, False)
+
+    def _set_health(self, url, healthy):
+        with self._lock:
+            changed = self.healthy[url] != healthy
+            self.healthy[url] = healthy
+        if changed:
+            print(f"Prediction shard {url} is {'back up' if healthy else 'down'}, rehashing its items")
+
+    def shards_for(self, item_code):
+        """The shards in ring order from the item's position: its owner first, then its fallbacks."""
+        start = bisect.bisect(self._points, _hash(str(item_code)))
+        order = []
+        for i in range(len(self._owners)):
+            url = self._owners[(start + i) % len(self._owners)]
+            if url not in order:
+                order.append(url)
+                if len(order) == len(self.urls):
+                    break
+        with self._lock:
+            healthy = [url for url in order if self.healthy[url]]
+        # With every shard down, still try them all rather than fail outright
+        return healthy + [url for url in order if url not in healthy]
+
+    def record(self, url):
+        """Count a request sent to the shard."""
+        with self._lock:
+            self.routed[url] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'shards': [{'url': url, 'healthy': self.healthy[url], 'ready': self.ready[url],
+                            'routed': self.routed[url]} for url in self.urls],
+                'last_check': self.last_check,
+            }
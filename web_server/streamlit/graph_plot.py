@@ -28,17 +28,19 @@ def plot(data,type):
         hovertemplate='%{y:.2f}<extra></extra>'
     ))
 
-    # Add shading to represent uncertainty in forecast
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([data[data['Type'] == 'Forecast']["Date"], data[data['Type'] == 'Forecast']["Date"][::-1]]),
-        y=np.concatenate([data[data['Type'] == 'Forecast']["Price"] + 5, (data[data['Type'] == 'Forecast']["Price"] - 5)[::-1]]),
-        fill='toself',
-        fillcolor='rgba(255, 0, 0, 0.2)',
-        line=dict(color='rgba(255,255,255,0)'),
-        hoverinfo="skip",
-        showlegend=False,
-        name='Uncertainty'
-    ))
+    # Add shading for the forecast uncertainty interval, when the predictor computed one
+    if 'Lower' in data and 'Upper' in data:
+        forecast = data[data['Type'] == 'Forecast']
+        fig.add_trace(go.Scatter(
+            x=np.concatenate([forecast["Date"], forecast["Date"][::-1]]),
+            y=np.concatenate([forecast["Upper"], forecast["Lower"][::-1]]),
+            fill='toself',
+            fillcolor='rgba(255, 0, 0, 0.2)',
+            line=dict(color='rgba(255,255,255,0)'),
+            hoverinfo="skip",
+            showlegend=False,
+            name='Uncertainty'
+        ))
     
     #ind to show where forcast starts
     ind = data.index[data['Type'] == 'Forecast'][0]- data.__len__()
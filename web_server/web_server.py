@@ -1,6 +1,11 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
+import json
+import math
+import os
+import time
 import requests
 import pandas as pd
+from shard_router import ShardRouter
 
 app = Flask(__name__)
 
@@ -11,6 +16,10 @@ app = Flask(__name__)
 PREDICTION_SERVER_URL = 'http://localhost:5002'
 SENTIMENT_SERVER_URL = 'http://localhost:5000'
 
+# Predictor instances, comma separated; each item is served by one of them (consistent hashing on the item code)
+PREDICTION_SERVER_URLS = os.environ.get('PREDICTION_SERVER_URLS', PREDICTION_SERVER_URL).split(',')
+prediction_shards = ShardRouter(PREDICTION_SERVER_URLS).start()
+
 product_id_name_mapping = pd.DataFrame()
 
 
@@ -37,60 +46,195 @@ def get_products():
     return jsonify(products_data)
 
 # -----Prediction part -----
-def get_prediction(endpoint, data):
-    try:
-        url = f'{PREDICTION_SERVER_URL}/{endpoint}'
-        product_id = data.get('product_id', None)
-        print(product_id)
-        time_period = data.get('time_period', None)
-        optional_date = data.get('optional_date', None)
-
-        if product_id and (time_period or optional_date):
-            response = requests.post(url, json={
-                'product_id': product_id,
-                'time_period': time_period,
-                'optional_date': optional_date
-            })
-            response.raise_for_status()
-
-            result = response.json()
+# Seconds between the keep-alive bytes sent while a prediction runs
+KEEPALIVE_INTERVAL = 1
+# Longest a request waits, in total, for room in the predictor's queue (it answers 429 with Retry-After when full)
+MAX_ADMISSION_WAIT = 30
 
-            # Get the data_path using the prediction_id
-            result['data_path'] = f'{PREDICTION_SERVER_URL}/get_data/{result["prediction_id"]}'
+# Prediction type, result field and display name of each endpoint
+prediction_endpoints = {
+    'predict_price': ('price', 'predicted_price', 'Price'),
+    'predict_demand': ('demand', 'predicted_demand', 'Demand'),
+}
 
-            result['product_name'] = \
-                product_id_name_mapping[product_id_name_mapping['Item Code'] == product_id]['Item Name'].iloc[0]
 
-            result['optional_date'] = optional_date
-
-            if endpoint == 'predict_price':
-                prediction_name = 'predicted_price'
-                result["type"] = "Price"
-            else:
-                prediction_name = 'predicted_demand'
-                result["type"] = "Demand"
+def cancel_prediction(shard, prediction_id):
+    try:
+        requests.delete(f'{shard}/predictions/{prediction_id}', timeout=5)
+    except requests.RequestException as e:
+        print(f"Could not cancel prediction {prediction_id}: {e}")
+
+
+def submit_prediction(product_id, payload):
+    """Submit the job to the item's shard, or the next one along the ring if it is down. Returns (shard, response)."""
+    for shard in prediction_shards.shards_for(product_id):
+        try:
+            response = requests.post(f'{shard}/predictions', json=payload)
+        except requests.ConnectionError:
+            prediction_shards.mark_down(shard)
+            continue
+        prediction_shards.record(shard)
+        return shard, response
+    raise requests.ConnectionError("No prediction server is reachable")
+
+
+def find_shard(prediction_id, product_id=None):
+    """
+    The shard holding a prediction: whichever has heard of it, asking the item's
+    shards in ring order when the item is known (the job may have failed over to
+    a later one), else every shard.
+    """
+    shards = prediction_shards.shards_for(product_id) if product_id else PREDICTION_SERVER_URLS
+    for shard in shards:
+        try:
+            if requests.get(f'{shard}/predictions/{prediction_id}', timeout=5).status_code != 404:
+                return shard
+        except requests.RequestException:
+            continue
+    return None
 
-            if result[prediction_name]:
-                result[prediction_name] = round(result[prediction_name], 2)
 
-            return result
+def get_prediction(endpoint, data):
+    """
+    Submit the prediction as a job to the item's shard and yield a space every
+    KEEPALIVE_INTERVAL seconds until it finishes, then the result as JSON
+    (leading whitespace is valid JSON). Once the client has gone away a write
+    fails and the generator is closed, which cancels the job on the predictor.
+    If the shard goes down meanwhile the job is submitted again to the next one.
+    """
+    prediction_type, prediction_name, type_name = prediction_endpoints[endpoint]
+    product_id = data.get('product_id', None)
+    print(product_id)
+    time_period = data.get('time_period', None)
+    optional_date = data.get('optional_date', None)
+
+    payload = {
+        'prediction_type': prediction_type,
+        'product_id': product_id,
+        'time_period': time_period,
+        'optional_date': optional_date
+    }
+    shard = None
+    prediction_id = None
+    finished = False
+    try:
+        deadline = time.monotonic() + MAX_ADMISSION_WAIT
+        for _ in PREDICTION_SERVER_URLS:
+            while True:
+                shard, response = submit_prediction(product_id, payload)
+                if response.status_code not in (429, 503):
+                    break
+                # The predictor is saturated or still warming up: come back when it says, keeping the client
+                # connection alive meanwhile
+                retry_after = float(response.headers.get('Retry-After', KEEPALIVE_INTERVAL))
+                if time.monotonic() + retry_after > deadline:
+                    yield json.dumps({"error": f"The prediction server is busy, try again in {math.ceil(retry_after)} s",
+                                      "retry_after": math.ceil(retry_after)})
+                    return
+                for _ in range(max(1, math.ceil(retry_after / KEEPALIVE_INTERVAL))):
+                    time.sleep(KEEPALIVE_INTERVAL)
+                    yield ' '
+            response.raise_for_status()
+            prediction_id = response.json()['prediction_id']
+
+            try:
+                while True:
+                    response = requests.get(f'{shard}/predictions/{prediction_id}',
+                                            params={'wait': KEEPALIVE_INTERVAL})
+                    response.raise_for_status()
+                    status = response.json()
+                    if status['state'] in ('done', 'failed', 'cancelled'):
+                        break
+                    yield ' '
+                break
+            except requests.ConnectionError:
+                # The shard went down with the job, its items now belong to the next shard
+                prediction_shards.mark_down(shard)
+                prediction_id = None
         else:
-            return "Error: Product ID or time period is missing", 400
+            raise requests.ConnectionError("Every prediction server went down during the prediction")
+        finished = True
+
+        if status['state'] != 'done':
+            yield json.dumps({"error": f"The prediction {status['state']}: {status.get('error', '')}"})
+            return
+
+        result = {
+            'prediction_id': prediction_id,
+            'product_id': status['product_id'],
+            prediction_name: status[prediction_name],
+            # Get the data_path using the prediction_id, on the shard that holds it
+            'data_path': f'{shard}/get_data/{prediction_id}',
+            'product_name':
+                product_id_name_mapping[product_id_name_mapping['Item Code'] == product_id]['Item Name'].iloc[0],
+            'optional_date': optional_date,
+            'type': type_name,
+        }
+
+        if result[prediction_name]:
+            result[prediction_name] = round(result[prediction_name], 2)
+
+        yield json.dumps(result)
 
     except requests.RequestException as e:
-        return {"error": f"An error occurred while communicating with the ML server: {str(e)}"}
+        finished = True
+        yield json.dumps({"error": f"An error occurred while communicating with the ML server: {str(e)}"})
+    finally:
+        # Closed early: the client went away, stop the fit nobody will read
+        if prediction_id is not None and not finished:
+            cancel_prediction(shard, prediction_id)
+
+
+def stream_prediction(endpoint):
+    data = request.json
+    if not data.get('product_id') or not (data.get('time_period') or data.get('optional_date')):
+        return jsonify({"error": "Product ID or time period is missing"}), 400
+    return Response(get_prediction(endpoint, data), mimetype='application/json')
 
 @app.route('/price_prediction', methods=['POST'])
 def price_prediction():
-    data = request.json
-    result = get_prediction('predict_price', data)
-    return jsonify(result)
+    return stream_prediction('predict_price')
 
 @app.route('/demand_prediction', methods=['POST'])
 def demand_prediction():
-    data = request.json
-    result = get_prediction('predict_demand', data)
-    return jsonify(result)
+    return stream_prediction('predict_demand')
+
+@app.route('/predictions/<prediction_id>', methods=['DELETE'])
+def delete_prediction(prediction_id):
+    # ?product_id= asks only the item's shards, its owner first
+    shard = find_shard(prediction_id, request.args.get('product_id'))
+    if shard is None:
+        return jsonify({"error": "Prediction not found"}), 404
+    try:
+        response = requests.delete(f'{shard}/predictions/{prediction_id}')
+    except requests.RequestException as e:
+        return jsonify({"error": f"An error occurred while communicating with the ML server: {str(e)}"}), 502
+    return Response(response.content, status=response.status_code, mimetype='application/json')
+
+# Headers of a shard's /get_data response that reach the client
+PASSED_RESPONSE_HEADERS = ('Content-Type', 'ETag', 'Cache-Control')
+
+@app.route('/get_data/<prediction_id>', methods=['GET'])
+def get_data(prediction_id):
+    # Same as the shard's /get_data; ?product_id= asks only the item's shards, its owner first
+    shard = find_shard(prediction_id, request.args.get('product_id'))
+    if shard is None:
+        return "Data not found", 404
+    headers = {'Accept': request.headers.get('Accept', '*/*')}
+    if 'If-None-Match' in request.headers:
+        headers['If-None-Match'] = request.headers['If-None-Match']
+    try:
+        response = requests.get(f'{shard}/get_data/{prediction_id}', params=request.args, headers=headers)
+    except requests.RequestException as e:
+        return jsonify({"error": f"An error occurred while communicating with the ML server: {str(e)}"}), 502
+    # Pass the validators back, so clients can revalidate through the proxy and get a 304
+    return Response(response.content, status=response.status_code,
+                    headers={name: response.headers[name] for name in PASSED_RESPONSE_HEADERS
+                             if name in response.headers})
+
+@app.route('/prediction_shards', methods=['GET'])
+def prediction_shard_status():
+    return jsonify(prediction_shards.stats())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)